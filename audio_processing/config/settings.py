@@ -150,6 +150,12 @@ class Settings(BaseSettings):
         description="Access token для сервиса транскрипции (если есть)"
     )
 
+    TRANSCRIPTION_TOKEN_TTL: int = Field(
+        default=3600,
+        ge=60,
+        description="Время жизни токена (секунды), если в нём нет claim exp"
+    )
+
     LOGIN: Optional[str] = Field(
         default=None,
         description="Логин для аутентификации в сервисе"
@@ -220,6 +226,32 @@ class Settings(BaseSettings):
         description="Максимальное количество попыток повтора при ошибке"
     )
 
+    TRANSCRIPTION_POLL_BASE_INTERVAL: float = Field(
+        default=1.0,
+        gt=0,
+        le=60,
+        description="Начальный интервал опроса статуса транскрипции (секунды)"
+    )
+
+    TRANSCRIPTION_POLL_MAX_INTERVAL: float = Field(
+        default=30.0,
+        gt=0,
+        le=300,
+        description="Максимальный интервал опроса статуса транскрипции (секунды)"
+    )
+
+    TRANSCRIPTION_POLL_JITTER: bool = Field(
+        default=True,
+        description="Случайный разброс интервала опроса (full jitter)"
+    )
+
+    TRANSCRIPTION_POLL_MAX_SECONDS: int = Field(
+        default=600,
+        ge=60,
+        le=7200,
+        description="Максимальное время ожидания результата транскрипции (секунды)"
+    )
+
     # ========== ЛИМИТЫ ФАЙЛОВ ==========
 
     MAX_FILE_SIZE_BYTES: int = Field(
@@ -228,10 +228,7 @@ class AudioProcessingApplication:
         except:
             task_pool_status = {}
 
-        total_processed = task_pool_status.get('processed', 0)
-        total_failed = task_pool_status.get('failed', 0)
-        total = total_processed + total_failed
-        success_rate = (total_processed / total * 100) if total > 0 else 0
+        success_rate = self.task_pool.success_rate if self.task_pool else 0
 
         return {
             "is_running": self.is_running,
@@ -251,10 +248,10 @@ class AudioProcessingApplication:
         """Получение полной статистики"""
         stats = self.get_status()
         
-        if self.task_pool and hasattr(self.task_pool, 'task_queue'):
+        if self.task_pool:
             stats["queue_stats"] = {
-                "current_size": self.task_pool.task_queue.qsize(),
-                "max_size": self.task_pool.task_queue.maxsize,
+                "current_size": self.task_pool.qsize(),
+                "max_size": self.task_pool.queue_max_size,
                 "processed_total": self.task_pool.processed_count,
                 "failed_total": self.task_pool.failed_count,
                 "queue_full_events": getattr(self.task_pool, 'queue_full_events', 0),
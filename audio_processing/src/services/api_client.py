@@ -24,6 +24,10 @@ class APIClient:
 
     async def start(self):
         """Инициализация клиента"""
+        # Сессия общая для всех worker'ов - повторный вызов её не пересоздаёт
+        if self.session and not self.session.closed:
+            return
+
         self.session = aiohttp.ClientSession()
         logger.info("api.client.started", endpoint=settings.API_ENDPOINT)
 
@@ -31,6 +35,7 @@ class APIClient:
         """Остановка клиента"""
         if self.session:
             await self.session.close()
+            self.session = None
             logger.info("api.client.stopped")
 
     async def send_transcription_result(
@@ -4,7 +4,7 @@
 
 import json
 from pathlib import Path
-from typing import Optional, List, Dict, Any
+from typing import Optional, List, Dict, Any, Set
 
 import structlog
 from config.settings import settings
@@ -144,88 +144,6 @@ class FileManager:
             )
             return False
 
-    async def move_file(
-        self,
-        source_bucket: str,
-        destination_bucket: str,
-        object_name: str,
-        temp_path: Optional[Path] = None
-    ) -> Optional[str]:
-        """
-        Перемещение файла между buckets.
-        
-        Для MinIO: использует copy + delete
-        Для локального хранилища: использует временный файл
-        """
-        try:
-            source = self._get_bucket_name(source_bucket)
-            dest = self._get_bucket_name(destination_bucket)
-
-            if not source or not dest:
-                logger.error(
-                    "invalid.bucket.names",
-                    source=source_bucket,
-                    dest=destination_bucket
-                )
-                return None
-
-            if settings.USE_MINIO:
-                # Для MinIO копируем и удаляем
-                # Note: MinIO Python SDK не имеет встроенного метода copy,
-                # поэтому используем download -> upload -> delete
-                
-                # Временный файл
-                import tempfile
-                temp_file = tempfile.NamedTemporaryFile(delete=False)
-                temp_path = temp_file.name
-                temp_file.close()
-
-                # Скачиваем
-                success = await self.storage.download_file(
-                    source, object_name, temp_path
-                )
-                if not success:
-                    return None
-
-                # Загружаем в новый bucket
-                success = await self.storage.upload_file(
-                    temp_path, dest, object_name
-                )
-                if not success:
-                    return None
-
-                # Удаляем исходный
-                await self.storage.delete_file(source, object_name)
-
-                # Удаляем временный файл
-                import os
-                os.unlink(temp_path)
-
-            else:
-                # Для локального хранилища просто копируем
-                await self.storage.upload_file(
-                    str(Path(source) / object_name),
-                    dest,
-                    object_name
-                )
-                # Удаляем исходный
-                await self.storage.delete_file(source, object_name)
-
-            logger.info(
-                "file.moved",
-                object_name=object_name,
-                source_bucket=source_bucket,
-                dest_bucket=destination_bucket
-            )
-            return object_name
-
-        except Exception as e:
-            logger.error(
-                "move.file.error",
-                object_name=object_name,
-                error=str(e)
-            )
-            return None
     async def move_file(
         self,
         source_bucket: str,
@@ -562,4 +480,82 @@ class FileManager:
                 object_name=object_name,
                 error=str(e)
             )
-            return False
\ No newline at end of file
+            return False
+
+
+class FileTransaction:
+    """
+    Транзакция обработки файла: upload → processed.
+
+    При входе на файл берётся lease в памяти: файл остаётся в upload,
+    а другие worker'ы его не возьмут. Вызов commit() переносит файл
+    сразу в processed. При выходе lease освобождается; если транзакция
+    не подтверждена, файл просто остаётся в upload.
+    """
+
+    def __init__(
+        self,
+        file_manager: "FileManager",
+        object_name: str,
+        source_bucket: str,
+        processed_bucket: str,
+        leases: Set[str],
+    ):
+        self.file_manager = file_manager
+        self.object_name = object_name
+        self.source_bucket = source_bucket
+        self.processed_bucket = processed_bucket
+        self.leases = leases
+        self._acquired = False
+        self._committed = False
+
+    @property
+    def committed(self) -> bool:
+        """Была ли транзакция подтверждена"""
+        return self._committed
+
+    async def __aenter__(self) -> "FileTransaction":
+        """Взять lease на файл"""
+        # Проверка и добавление без await между ними - атомарны в цикле событий
+        if self.object_name in self.leases:
+            raise FileManagementError(
+                f"File {self.object_name} is already being processed"
+            )
+
+        self.leases.add(self.object_name)
+        self._acquired = True
+        logger.debug("file.leased", file=self.object_name)
+        return self
+
+    async def commit(self) -> bool:
+        """
+        Подтвердить транзакцию - переместить файл в processed.
+
+        Returns:
+            True если файл перемещён, False иначе (файл останется в upload)
+        """
+        if self._committed:
+            return True
+
+        logger.debug("file.final.move.starting", file=self.object_name)
+
+        moved = await self.file_manager.move_file(
+            source_bucket=self.source_bucket,
+            destination_bucket=self.processed_bucket,
+            object_name=self.object_name,
+        )
+
+        if moved:
+            self._committed = True
+            logger.debug("file.moved.to.processed", file=self.object_name)
+
+        return bool(moved)
+
+    async def __aexit__(self, exc_type, exc, tb) -> bool:
+        """Освободить lease"""
+        if self._acquired:
+            self.leases.discard(self.object_name)
+            if not self._committed:
+                logger.info("file.left.in.upload", file=self.object_name)
+
+        return False
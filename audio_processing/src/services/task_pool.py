@@ -1,11 +1,15 @@
 import asyncio
+import contextvars
 import time
-from typing import List, Optional, Dict, Any
+from collections import deque
+from contextlib import aclosing
+from typing import List, Optional, Dict, Any, Set
 from pathlib import Path
 import structlog
 
 from config.settings import settings
 from src.core.exceptions import ServiceError
+from src.services.file_manager import FileTransaction
 
 logger = structlog.get_logger()
 
@@ -20,6 +24,10 @@ class TaskPool:
     - Метрик и логирования
     """
 
+    # Общий пустой контекст для внутренних задач пула: worker'ы не меняют
+    # ContextVar'ы, поэтому копировать контекст вызывающего не нужно
+    _EMPTY_CTX = contextvars.Context()
+
     def __init__(
         self,
         transcription_service,
@@ -46,15 +54,23 @@ class TaskPool:
         self.transcription_sem = asyncio.Semaphore(max_transcription_calls)
         self.api_sem = asyncio.Semaphore(max_api_calls)
 
-        # Очередь задач
-        self.task_queue = asyncio.Queue(maxsize=queue_max_size)
+        # Очередь задач: deque + Event для пробуждения worker'ов
+        # (без Future на каждый put/get, как у asyncio.Queue)
+        self.queue_max_size = queue_max_size
+        self._deque: deque = deque()
+        self._has_items = asyncio.Event()
         self.tasks: List[asyncio.Task] = []
+        self._supervisor: Optional[asyncio.Task] = None
+
+        # Файлы, которые сейчас обрабатываются (lease вместо bucket'а processing)
+        self._leased: Set[str] = set()
 
         # Флаги состояния
         self.is_running = False
         self.is_paused = False
         self.pause_event = asyncio.Event()
         self.pause_event.set()
+        self._shutdown = asyncio.Event()
 
         # Статистика
         self.processed_count = 0
@@ -99,15 +115,30 @@ class TaskPool:
         self.is_running = True
         self.is_paused = False
         self.pause_event.set()
+        self._shutdown.clear()
+
+        # HTTP-сессии сервисов общие для всех worker'ов: открыть их заранее,
+        # чтобы первые задачи не тратили время на создание соединений
+        await asyncio.gather(
+            self.transcription_service.start(),
+            self.api_client.start(),
+        )
 
-        # Создать N worker'ов
-        for i in range(self.max_concurrent_tasks):
-            task = asyncio.create_task(self.worker(i))
-            self.tasks.append(task)
-            logger.debug("worker.created", worker_id=i)
+        # Worker'ы живут внутри TaskGroup под управлением одной задачи-супервизора
+        self._supervisor = asyncio.get_running_loop().create_task(
+            self._run_workers(), context=self._EMPTY_CTX
+        )
 
         logger.info("task.pool.started")
 
+    async def _run_workers(self) -> None:
+        """Запустить N worker'ов в TaskGroup и дождаться их завершения"""
+        async with asyncio.TaskGroup() as tg:
+            for i in range(self.max_concurrent_tasks):
+                task = tg.create_task(self.worker(i), context=self._EMPTY_CTX)
+                self.tasks.append(task)
+                logger.debug("worker.created", worker_id=i)
+
     async def stop(self, timeout: int = 15) -> None:
         """
         Остановить пул задач с гарантией завершения всех worker'ов.
@@ -121,60 +152,44 @@ class TaskPool:
         logger.info("task.pool.stopping", workers_count=len(self.tasks))
         self.is_running = False
         self.is_paused = False
+        self._shutdown.set()
         self.pause_event.set()
+        # Разбудить worker'ы, ожидающие новых задач
+        self._has_items.set()
 
-        # Добавить сигналы завершения для всех worker'ов
         num_workers = len(self.tasks)
-        for i in range(num_workers):
-            try:
-                self.task_queue.put_nowait(None)
-                logger.debug("worker.stop.signal.sent", worker_id=i)
-            except asyncio.QueueFull:
-                logger.warning("task.queue.full.during.stop")
-                break
 
         # Ждать завершения всех worker'ов
         try:
             logger.info("task.pool.waiting.for.workers", timeout=timeout)
-            results = await asyncio.wait_for(
-                asyncio.gather(*self.tasks, return_exceptions=True),
-                timeout=timeout,
-            )
+            async with asyncio.timeout(timeout):
+                await self._supervisor
             logger.info("task.pool.all.workers.completed")
 
-            for i, result in enumerate(results):
-                if isinstance(result, Exception):
-                    logger.warning(
-                        "worker.failed.with.exception",
-                        worker_id=i,
-                        error=str(result),
-                    )
-
-        except asyncio.TimeoutError:
+        except TimeoutError:
             logger.warning(
                 "task.pool.shutdown.timeout",
                 timeout=timeout,
                 workers_count=len(self.tasks),
             )
 
-            # Отменить оставшихся worker'ов
+            # Отмена супервизора отменяет всех оставшихся worker'ов в TaskGroup
             logger.info("task.pool.cancelling.remaining.workers")
-            for i, task in enumerate(self.tasks):
-                if not task.done():
-                    logger.warning("worker.cancelling", worker_id=i)
-                    task.cancel()
-                    try:
-                        await task
-                    except asyncio.CancelledError:
-                        logger.debug("worker.cancelled.successfully", worker_id=i)
-                    except Exception as e:
-                        logger.warning(
-                            "worker.cancellation.error",
-                            worker_id=i,
-                            error=str(e),
-                        )
+            self._supervisor.cancel()
+            try:
+                await self._supervisor
+            except asyncio.CancelledError:
+                logger.debug("task.pool.workers.cancelled")
+
+        except BaseExceptionGroup as eg:
+            for error in eg.exceptions:
+                logger.warning(
+                    "worker.failed.with.exception",
+                    error=str(error),
+                )
 
         # Очистить список tasks
+        self._supervisor = None
         self.tasks.clear()
         logger.info("task.pool.stopped", workers_stopped=num_workers)
 
@@ -194,17 +209,23 @@ class TaskPool:
         if isinstance(filename, Path):
             filename = filename.name
 
-        try:
-            self.task_queue.put_nowait(filename)
-            logger.debug("task.added.to.queue", file=filename)
-        except asyncio.QueueFull:
-            self.queue_full_events += 1
-            logger.warning(
-                "task.queue.full",
-                file=filename,
-                queue_size=self.task_queue.qsize(),
-            )
-            raise ServiceError("Task queue is full")
+        if len(self._deque) >= self.queue_max_size:
+            # Один раз уступить цикл событий, чтобы worker'ы успели
+            # разобрать очередь, и повторить без таймера wait_for
+            await asyncio.sleep(0)
+            if len(self._deque) >= self.queue_max_size:
+                self.queue_full_events += 1
+                logger.warning(
+                    "task.queue.full",
+                    file=filename,
+                    queue_size=len(self._deque),
+                )
+                raise ServiceError("Task queue is full")
+
+        self._deque.append(filename)
+        self._has_items.set()
+
+        logger.debug("task.added.to.queue", file=filename)
 
     async def worker(self, worker_id: int) -> None:
         """
@@ -216,25 +237,19 @@ class TaskPool:
         logger.info("worker.started", worker_id=worker_id)
 
         try:
-            while self.is_running:
+            while self.is_running and not self._shutdown.is_set():
                 # Проверить pause
                 await self.pause_event.wait()
 
-                try:
-                    # Получить файл из очереди (timeout 1 сек)
-                    filename = await asyncio.wait_for(
-                        self.task_queue.get(),
-                        timeout=1.0,
-                    )
+                # Очередь пуста - ждать add_task() или stop()
+                if not self._deque:
+                    self._has_items.clear()
+                    await self._has_items.wait()
+                    continue
 
-                    # None = сигнал завершения
-                    if filename is None:
-                        logger.debug(
-                            "worker.received.stop.signal",
-                            worker_id=worker_id,
-                        )
-                        break
+                filename = self._deque.popleft()
 
+                try:
                     logger.debug(
                         "worker.processing",
                         worker_id=worker_id,
@@ -244,10 +259,6 @@ class TaskPool:
                     # Обработать файл
                     await self.process_file(filename)
 
-                except asyncio.TimeoutError:
-                    # Нет файлов в очереди - продолжаем ждать
-                    continue
-
                 except Exception as e:
                     logger.error(
                         "task.unexpected.error",
@@ -264,170 +275,187 @@ class TaskPool:
     async def process_file(self, filename: str) -> None:
         """
         Полный процесс обработки файла:
-        1. Переместить из upload → processing
-        2. Получить данные файла из MinIO
-        3. Отправить на транскрипцию (БЕЗ ВРЕМЕННОГО ФАЙЛА!)
+        1. Взять lease на файл (вход в FileTransaction)
+        2. Получить размер файла из upload
+        3. Отправить на транскрипцию потоком (БЕЗ ВРЕМЕННОГО ФАЙЛА!)
         4. Получить результаты
-        5. Сохранить JSON
+        5. Сохранить JSON (параллельно с шагом 6, до шага 7)
         6. Отправить на API
-        7. Переместить в processed
+        7. Переместить upload → processed (commit транзакции)
+
+        Файл читается прямо из upload - промежуточное перемещение в
+        processing не нужно. Если транзакция не подтверждена, файл
+        остаётся в upload.
         
         Args:
             filename: Имя файла для обработки
         """
         start_time = time.time()
-        processing_file = None
-        file_bytes = None
+        file_size = None
 
         try:
             logger.info("file.processing.start", file=filename)
 
             # Получить имена bucket'ов
             upload_bucket = self.get_bucket_name("upload")
-            processing_bucket = self.get_bucket_name("processing")
             processed_bucket = self.get_bucket_name("processed")
 
             logger.debug(
                 "buckets.info",
                 upload=upload_bucket,
-                processing=processing_bucket,
                 processed=processed_bucket,
             )
 
-            # ========== ШАГ 1: Переместить файл ==========
-            logger.debug("file.move.starting", file=filename, from_="upload", to="processing")
-            
-            processing_file = await self.file_manager.move_file(
-                source_bucket=upload_bucket,
-                destination_bucket=processing_bucket,
-                object_name=filename,
-            )
-
-            if not processing_file:
-                logger.error("file.move.failed", file=filename)
-                self.failed_count += 1
+            # ========== ШАГ 1: Взять lease на файл ==========
+            if filename in self._leased:
+                logger.warning("file.already.leased", file=filename)
                 return
 
-            logger.debug("file.moved.to.processing", file=filename)
-
-            # ========== ШАГ 2: Получить данные файла ==========
-            logger.debug("file.data.retrieval.starting", file=filename)
-            
-            file_bytes = await self.file_manager.storage.get_file_data(
-                bucket=processing_bucket,
+            async with FileTransaction(
+                file_manager=self.file_manager,
                 object_name=filename,
-            )
+                source_bucket=upload_bucket,
+                processed_bucket=processed_bucket,
+                leases=self._leased,
+            ) as tx:
 
-            if not file_bytes:
-                logger.error("file.data.retrieval.failed", file=filename)
-                self.failed_count += 1
-                return
+                # ========== ШАГ 2: Получить размер файла ==========
+                logger.debug("file.data.retrieval.starting", file=filename)
 
-            logger.debug(
-                "file.data.retrieved",
-                file=filename,
-                size=len(file_bytes),
-                size_mb=round(len(file_bytes) / 1024 / 1024, 2),
-            )
-
-            # ========== ШАГ 3: Отправить на транскрипцию ==========
-            # ✅ БЕЗ ВРЕМЕННОГО ФАЙЛА! Отправляем байты напрямую
-            
-            async with self.transcription_sem:
-                logger.debug(
-                    "transcription.submission.starting",
-                    file=filename,
-                )
-                
-                job_id = await self.transcription_service.submit_transcription_job(
-                    file_bytes=file_bytes,  # ✅ Байты напрямую!
-                    filename=filename,       # ✅ Только имя файла!
+                file_size = await self.file_manager.storage.get_file_size(
+                    bucket=upload_bucket,
+                    object_name=filename,
                 )
 
-                if not job_id:
-                    logger.error("transcription.submission.failed", file=filename)
+                if not file_size:
+                    logger.error("file.data.retrieval.failed", file=filename)
                     self.failed_count += 1
                     return
 
                 logger.debug(
-                    "transcription.submitted",
+                    "file.data.retrieved",
                     file=filename,
-                    job_id=job_id,
+                    size=file_size,
+                    size_mb=round(file_size / 1024 / 1024, 2),
                 )
 
-            # ========== ШАГ 4: Получить результаты транскрипции ==========
-            logger.debug(
-                "transcription.polling.starting",
-                file=filename,
-                job_id=job_id,
-            )
-            
-            transcription_result = await self.transcription_service.poll_transcription_result(
-                job_id
-            )
+                # ========== ШАГ 3: Отправить на транскрипцию ==========
+                # ✅ Файл не буферизуется целиком - части из хранилища
+                # сразу уходят в запрос к сервису транскрипции
 
-            if not transcription_result:
-                logger.error(
-                    "transcription.result.retrieval.failed",
+                async with self.transcription_sem, aclosing(
+                    self.file_manager.storage.iter_file_chunks(
+                        bucket=upload_bucket,
+                        object_name=filename,
+                    )
+                ) as file_stream:
+                    logger.debug(
+                        "transcription.submission.starting",
+                        file=filename,
+                    )
+
+                    job_id = await self.transcription_service.submit_transcription_job(
+                        filename=filename,
+                        file_stream=file_stream,
+                        size=file_size,
+                    )
+
+                    if not job_id:
+                        logger.error("transcription.submission.failed", file=filename)
+                        self.failed_count += 1
+                        return
+
+                    # Первая проверка статуса идёт параллельно с закрытием
+                    # потока файла и освобождением семафора
+                    first_check = asyncio.create_task(
+                        self.transcription_service.check_transcription_status(job_id)
+                    )
+
+                    logger.debug(
+                        "transcription.submitted",
+                        file=filename,
+                        job_id=job_id,
+                    )
+
+                # ========== ШАГ 4: Получить результаты транскрипции ==========
+                logger.debug(
+                    "transcription.polling.starting",
                     file=filename,
                     job_id=job_id,
                 )
-                self.failed_count += 1
-                return
 
-            logger.debug(
-                "transcription.result.retrieved",
-                file=filename,
-                job_id=job_id,
-            )
+                transcription_result = await self.transcription_service.poll_transcription_result(
+                    job_id, first_status=await first_check
+                )
 
-            # ========== ШАГ 5: Сохранить JSON результат ==========
-            logger.debug("json.result.save.starting", file=filename)
-            
-            json_result = transcription_result
-            json_name = await self.file_manager.save_transcription_result(
-                json_result,
-                filename,
-            )
+                if not transcription_result:
+                    logger.error(
+                        "transcription.result.retrieval.failed",
+                        file=filename,
+                        job_id=job_id,
+                    )
+                    self.failed_count += 1
+                    return
 
-            if not json_name:
-                logger.error("json.result.save.failed", file=filename)
-                self.failed_count += 1
-                return
+                logger.debug(
+                    "transcription.result.retrieved",
+                    file=filename,
+                    job_id=job_id,
+                )
 
-            logger.debug("json.result.saved", file=filename, json_name=json_name)
+                # ========== ШАГ 5: Сохранить JSON результат (в фоне) ==========
+                # Сохранение JSON не зависит от отправки на API, поэтому
+                # запускаем его параллельно и не ждём на критическом пути
+                logger.debug("json.result.save.starting", file=filename)
 
-            # ========== ШАГ 6: Отправить на API backend ==========
-            async with self.api_sem:
-                logger.debug("api.send.starting", file=filename)
-                
-                api_success = await self.api_client.send_transcription_result(
-                    json_result,
-                    filename,
+                json_result = transcription_result
+                json_task = asyncio.create_task(
+                    self.file_manager.save_transcription_result(
+                        json_result,
+                        filename,
+                    )
                 )
 
+                # ========== ШАГ 6: Отправить на API backend ==========
+                async with self.api_sem:
+                    logger.debug("api.send.starting", file=filename)
+
+                    api_success = await self.api_client.send_transcription_result(
+                        json_result,
+                        filename,
+                    )
+
                 if not api_success:
                     logger.error("api.send.failed", file=filename)
+                    await asyncio.gather(json_task, return_exceptions=True)
                     self.failed_count += 1
                     return
 
                 logger.debug("api.result.sent", file=filename)
 
-            # ========== ШАГ 7: Переместить в processed ==========
-            logger.debug("file.final.move.starting", file=filename)
-            
-            final_file = await self.file_manager.move_file(
-                source_bucket=processing_bucket,
-                destination_bucket=processed_bucket,
-                object_name=filename,
-            )
+                # ========== ШАГ 7: Переместить в processed ==========
+                # Commit только после сохранения JSON: без результата
+                # файл не должен попасть в processed и остаётся в upload
+                try:
+                    json_name = await json_task
+                except Exception as json_error:
+                    json_name = json_error
 
-            if not final_file:
-                logger.error("file.final.move.failed", file=filename)
-                self.failed_count += 1
-                return
+                if isinstance(json_name, Exception) or not json_name:
+                    logger.error(
+                        "json.result.save.failed",
+                        file=filename,
+                        error=str(json_name) if isinstance(json_name, Exception) else None,
+                    )
+                    self.failed_count += 1
+                    return
 
-            logger.debug("file.moved.to.processed", file=filename)
+                logger.debug("json.result.saved", file=filename, json_name=json_name)
+
+                if not await tx.commit():
+                    logger.error("file.final.move.failed", file=filename)
+                    self.failed_count += 1
+                    return
 
             # ========== УСПЕХ! ==========
             elapsed = time.time() - start_time
@@ -446,7 +474,7 @@ class TaskPool:
                     await self.metrics.record_successful_processing(
                         filename=filename,
                         processing_time=elapsed,
-                        size_bytes=len(file_bytes) if file_bytes else 0,
+                        size_bytes=file_size or 0,
                     )
                     logger.debug(
                         "metrics.success.recorded",
@@ -488,29 +516,6 @@ class TaskPool:
                         error=str(metric_error),
                     )
 
-        finally:
-            # Вернуть файл в upload если что-то пошло не так
-            if processing_file:
-                try:
-                    upload_bucket = self.get_bucket_name("upload")
-                    processing_bucket = self.get_bucket_name("processing")
-                    
-                    await self.file_manager.move_file(
-                        source_bucket=processing_bucket,
-                        destination_bucket=upload_bucket,
-                        object_name=filename,
-                    )
-                    logger.info("file.returned.to.upload", file=filename)
-                except Exception as move_error:
-                    logger.error(
-                        "file.return.failed",
-                        file=filename,
-                        error=str(move_error),
-                    )
-
-            # Очистить переменные
-            file_bytes = None
-
     async def pause(self) -> None:
         """Приостановить обработку файлов"""
         if self.is_paused:
@@ -529,13 +534,24 @@ class TaskPool:
         self.is_paused = False
         self.pause_event.set()
 
+    @property
+    def success_rate(self) -> float:
+        """Процент успешно обработанных файлов (вычисляется только при запросе)"""
+        total = self.processed_count + self.failed_count
+        return (self.processed_count / total * 100) if total > 0 else 0.0
+
+    def qsize(self) -> int:
+        """Количество файлов, ожидающих обработки"""
+        return len(self._deque)
+
     def get_status(self) -> Dict[str, Any]:
         """Получить статус TaskPool"""
         return {
             "is_running": self.is_running,
             "is_paused": self.is_paused,
-            "queue_size": self.task_queue.qsize(),
+            "queue_size": self.qsize(),
             "processed": self.processed_count,
             "failed": self.failed_count,
             "queue_full_events": self.queue_full_events,
+            "success_rate": round(self.success_rate, 2),
         }
\ No newline at end of file
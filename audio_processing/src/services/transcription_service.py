@@ -1,775 +1,1153 @@
-import aiohttp
-import asyncio
-import json
-import os
-from typing import Optional, Dict, Any, List
-from pathlib import Path
-from datetime import datetime
-
-
-
-try:
-    from config.settings import settings
-except ImportError:
-    from config.settings import settings
-
-
-
-from src.core.exceptions import TranscriptionError
-import structlog
-
-
-
-logger = structlog.get_logger()
-
-
-
-class TranscriptionService:
-    """Сервис для работы с API транскрипции с поддержкой асинхронной обработки"""
-    
-    def __init__(self):
-        self.auth_token: Optional[str] = settings.TRANSCRIPTION_ACCESS_TOKEN
-        self.session: Optional[aiohttp.ClientSession] = None
-        self.max_retries = settings.API_MAX_RETRIES
-        
-        # ✅ ФЛАГ АВТОРИЗАЦИИ
-        self.use_authorization = getattr(settings, 'USE_AUTHORIZATION', False)
-        
-        # ✅ ОПТИМИЗИРОВАННЫЕ ТАЙМАУТЫ
-        self.auth_timeout = aiohttp.ClientTimeout(total=60.0)
-        self.timeout = aiohttp.ClientTimeout(total=settings.TRANSCRIPTION_TIMEOUT)
-        
-        # Параметры для асинхронной обработки
-        self.polling_interval = 2.0
-        self.max_polling_attempts = 300
-        
-        # Параметры авторизации
-        self.auth_max_retries = 5
-        self.auth_retry_delay = 5.0
-        
-        logger.info("transcription.service.configured",
-                   use_authorization=self.use_authorization)
-
-
-
-    async def start(self):
-        """Инициализация сервиса - авторизация опциональна"""
-        self.session = aiohttp.ClientSession()
-        
-        logger.info("transcription.service.starting",
-                   mode="with_auth" if self.use_authorization else "no_auth")
-        
-        # ✅ АВТОРИЗАЦИЯ ТОЛЬКО ЕСЛИ ВКЛЮЧЕНА
-        if self.use_authorization:
-            if not self.auth_token and settings.LOGIN and settings.PASSWORD:
-                try:
-                    logger.info("transcription.service.attempting_authentication_on_startup")
-                    await self._authenticate(retry=True)
-                    logger.info("transcription.service.authenticated_on_startup")
-                except Exception as e:
-                    logger.warning("transcription.service.auth_failed_on_startup",
-                                  error=str(e),
-                                  error_type=type(e).__name__,
-                                  message="Will retry authentication on first transcription request")
-        else:
-            logger.info("transcription.service.auth_disabled")
-
-
-
-    async def stop(self):
-        """Остановка сервиса"""
-        if self.session:
-            await self.session.close()
-            logger.info("transcription.service.stopped")
-
-
-
-    async def _authenticate(self, retry: bool = True) -> str:
-        """
-        Асинхронная авторизация в сервисе транскрипции.
-        
-        Пропускается если USE_AUTHORIZATION=False
-        """
-        # ✅ ВЫХОД ЕСЛИ АВТОРИЗАЦИЯ ОТКЛЮЧЕНА
-        if not self.use_authorization:
-            logger.info("transcription.auth.skipped_auth_disabled")
-            return None
-        
-        max_retries = self.auth_max_retries if retry else 1
-        
-        logger.info("authentication.starting", max_retries=max_retries)
-        
-        for attempt in range(1, max_retries + 1):
-            try:
-                data = {
-                    'username': settings.LOGIN,
-                    'password': settings.PASSWORD
-                }
-                
-                headers = {
-                    'accept': 'application/json',
-                    'Content-Type': 'application/x-www-form-urlencoded'
-                }
-
-
-                logger.info("authentication.attempt.sending",
-                           attempt=attempt,
-                           max_retries=max_retries,
-                           timeout=self.auth_timeout.total)
-
-
-                async with self.session.post(
-                    settings.AUTHORIZATION_SERVICE_URL,
-                    data=data,
-                    headers=headers,
-                    timeout=self.auth_timeout
-                ) as response:
-                    if response.status == 200:
-                        response_body = await response.json()
-                        access_token = response_body.get("x-access-token")
-                        if access_token:
-                            self.auth_token = access_token
-                            logger.info("authentication.successful", 
-                                       token_prefix=access_token[:10] + "...",
-                                       attempt=attempt)
-                            return access_token
-                        else:
-                            raise TranscriptionError("x-access-token not found in response")
-                    else:
-                        text = await response.text()
-                        logger.error("authentication.failed", 
-                                   status_code=response.status, 
-                                   response_text=text[:200],
-                                   attempt=attempt)
-                        raise aiohttp.ClientResponseError(
-                            request_info=response.request_info,
-                            history=response.history,
-                            status=response.status,
-                            message=f"Authorization failed: {text[:200]}"
-                        )
-                        
-            except asyncio.TimeoutError as e:
-                logger.warning("authentication.timeout",
-                              attempt=attempt,
-                              max_retries=max_retries,
-                              timeout=self.auth_timeout.total,
-                              error=str(e))
-                
-                if attempt < max_retries:
-                    delay = self.auth_retry_delay * (2 ** (attempt - 1))
-                    delay = min(delay, 60.0)
-                    
-                    logger.info("authentication.retrying_after_timeout", 
-                               attempt=attempt,
-                               next_delay=delay)
-                    await asyncio.sleep(delay)
-                    continue
-                else:
-                    logger.error("authentication.failed_after_timeout_retries",
-                               max_retries=max_retries)
-                    raise TranscriptionError(f"Authentication timeout after {max_retries} attempts: {e}")
-            
-            except aiohttp.ClientConnectorError as e:
-                logger.warning("authentication.connection_error",
-                              attempt=attempt,
-                              max_retries=max_retries,
-                              error=str(e))
-                
-                if attempt < max_retries:
-                    delay = self.auth_retry_delay * (2 ** (attempt - 1))
-                    delay = min(delay, 60.0)
-                    
-                    logger.info("authentication.retrying_after_connection_error", 
-                               attempt=attempt,
-                               next_delay=delay)
-                    await asyncio.sleep(delay)
-                    continue
-                else:
-                    logger.error("authentication.failed_after_connection_error_retries",
-                               max_retries=max_retries)
-                    raise TranscriptionError(f"Connection error after {max_retries} attempts: {e}")
-            
-            except aiohttp.ClientResponseError as e:
-                logger.error("authentication.response_error",
-                           status=e.status,
-                           attempt=attempt,
-                           error=str(e))
-                
-                if attempt < max_retries and e.status >= 500:
-                    delay = self.auth_retry_delay * attempt
-                    delay = min(delay, 60.0)
-                    
-                    logger.info("authentication.retrying_after_server_error", 
-                               attempt=attempt,
-                               next_delay=delay,
-                               status=e.status)
-                    await asyncio.sleep(delay)
-                    continue
-                else:
-                    raise TranscriptionError(f"Authentication error: {e}")
-                
-            except Exception as e:
-                logger.error("authentication.unexpected_error", 
-                           error=str(e), 
-                           error_type=type(e).__name__,
-                           attempt=attempt)
-                raise TranscriptionError(f"Authentication error: {e}")
-        
-        raise TranscriptionError(f"Authentication failed after {max_retries} attempts")
-
-
-
-    # ============ АСИНХРОННАЯ ОБРАБОТКА ============
-
-
-    async def submit_transcription_job(self, file_bytes: bytes, filename: str) -> Optional[str]:
-        """
-        Отправить файл аудио на транскрипцию.
-        
-        Args:
-            file_bytes: Байты аудиофайла (напрямую из MinIO)
-            filename: Имя файла (например, "audio.mp3")
-        
-        Returns:
-            task_id: ID задачи транскрипции или None
-        """
-        task_id = None
-        
-        try:
-            file_size_mb = len(file_bytes) / 1024 / 1024
-            logger.info(
-                "transcription.async_job.submitting",
-                file=filename,
-                file_size_mb=round(file_size_mb, 2)
-            )
-            
-            # ✅ Аутентификация если нужна
-            if self.use_authorization and not self.auth_token:
-                logger.info("transcription.no_token_attempting_auth")
-                await self.authenticate(retry=True)
-            
-            # ✅ Параметры для API
-            params = {
-                "speakers": "1",
-                "speaker_counter": "0",
-                "async": "1",
-                "1": "1",
-                "punctuation": "0",
-                "normalization": "0",
-                "toxicity": "1",
-                "emotion": "1",
-                "voice_analyzer": "1",
-                "vad": "webrtc",
-                "classifiers": '{"smc":{"Скрипты1":{"correction":1,"confidenceThreshold":40}},"see":{"FIO":{"correction":1,"confidenceThreshold":40}}}'
-            }
-            
-            # ✅ Заголовки
-            headers = {"accept": "application/json"}
-            if self.use_authorization and self.auth_token:
-                headers["x-access-token"] = self.auth_token
-            
-            # ✅ НОВОЕ: Формируем данные напрямую из file_bytes (БЕЗ ВРЕМЕННОГО ФАЙЛА!)
-            data = aiohttp.FormData()
-            
-            # Добавляем байты файла напрямую
-            data.add_field(
-                "wav",
-                file_bytes,
-                filename=filename,
-                content_type=f"audio/{self.get_file_extension(filename)}"
-            )
-            
-            # Добавляем параметры
-            for key, value in params.items():
-                data.add_field(key, str(value))
-            
-            # ✅ POST запрос с байтами (не с файлом!)
-            async with self.session.post(
-                settings.TRANSCRIPTION_SERVICE_URL,
-                data=data,
-                headers=headers,
-                timeout=self.timeout
-            ) as response:
-                if response.status == 200:
-                    result = await response.json()
-                    
-                    logger.debug(
-                        "transcription.submit.raw_response",
-                        job_response=result
-                    )
-                    
-                    task_id = result.get("taskID")
-                    if not task_id:
-                        logger.error(
-                            "transcription.async_job.no_id_in_response",
-                            response=result
-                        )
-                        return None
-                    
-                    logger.info(
-                        "transcription.async_job.submitted",
-                        file=filename,
-                        task_id=task_id,
-                        file_size_mb=round(file_size_mb, 2)
-                    )
-                    
-                    return task_id
-                
-                elif response.status == 401:
-                    # Token истек
-                    if self.use_authorization:
-                        logger.warning(
-                            "transcription.token.expired",
-                            file=filename
-                        )
-                        self.auth_token = None
-                        await self.authenticate(retry=True)
-                        raise aiohttp.ClientResponseError(
-                            request_info=response.request_info,
-                            history=response.history,
-                            status=response.status,
-                            message="Token expired or authentication required"
-                        )
-                    else:
-                        text = await response.text()
-                        logger.error(
-                            "transcription.async_job.api_error",
-                            file=filename,
-                            status_code=response.status,
-                            response_text=text[:200]
-                        )
-                        raise aiohttp.ClientResponseError(
-                            request_info=response.request_info,
-                            history=response.history,
-                            status=response.status,
-                            message=text[:200]
-                        )
-                
-                else:
-                    text = await response.text()
-                    logger.error(
-                        "transcription.async_job.api_error",
-                        file=filename,
-                        status_code=response.status,
-                        response_text=text[:200]
-                    )
-                    raise aiohttp.ClientResponseError(
-                        request_info=response.request_info,
-                        history=response.history,
-                        status=response.status,
-                        message=text[:200]
-                    )
-        
-        except Exception as e:
-            logger.error(
-                "transcription.async_job.submission.error",
-                error=str(e),
-                file=filename
-            )
-            return None
-
-
-    def get_file_extension(self, filename: str) -> str:
-        """
-        Получить расширение файла для определения MIME type.
-        
-        Args:
-            filename: Имя файла (например, "audio.mp3")
-        
-        Returns:
-            Расширение без точки (например, "mpeg")
-        """
-        import os
-        
-        # Получить расширение файла
-        _, ext = os.path.splitext(filename)
-        ext = ext.lower().lstrip('.')  # Убрать точку и сделать нижний регистр
-        
-        # Маппинг расширений на MIME types
-        mime_map = {
-            'mp3': 'mpeg',
-            'wav': 'wav',
-            'm4a': 'mp4',
-            'flac': 'flac',
-            'ogg': 'ogg',
-            'aac': 'aac',
-        }
-        
-        # Вернуть соответствующий MIME type или исходное расширение
-        return mime_map.get(ext, ext or 'mpeg')
-
-
-    async def check_transcription_status(self, task_id: str) -> Optional[Dict[str, Any]]:
-        """
-        Проверить статус обработки по taskID.
-        
-        Использует endpoint: GET /spr/result/{taskID}
-        
-        Статусы:
-        - ready: готово (есть результат)
-        - waiting: ожидание (еще обрабатывается)
-        - not found: не найдена
-        - failed: сбой
-        
-        Возвращает словарь с информацией о статусе.
-        """
-        try:
-            logger.debug("transcription.status.checking", task_id=task_id)
-            
-            # ✅ АВТОРИЗАЦИЯ ТОЛЬКО ЕСЛИ НУЖНА
-            if self.use_authorization and not self.auth_token:
-                await self._authenticate(retry=True)
-            
-            # ✅ ЗАГОЛОВКИ БЕЗ ТОКЕНА, ЕСЛИ АВТОРИЗАЦИЯ ОТКЛЮЧЕНА
-            headers = {
-                'accept': 'application/json'
-            }
-            
-            if self.use_authorization and self.auth_token:
-                headers['x-access-token'] = self.auth_token
-            
-            # ✅ ПРАВИЛЬНЫЙ ENDPOINT для получения результата
-            result_url = f"{settings.TRANSCRIPTION_SERVICE_BY_JOB_URL}/{task_id}"
-            logger.debug("transcription.status.request_url", url=result_url)
-            
-            async with self.session.get(
-                result_url,
-                headers=headers,
-                timeout=self.timeout
-            ) as response:
-                
-                if response.status == 200:
-                    result = await response.json()
-                    
-                    # ✅ ЛОГИРУЕМ ПОЛНЫЙ ОТВЕТ
-                    logger.debug("transcription.status.raw_response",
-                                task_id=task_id,
-                                status_response=result,
-                                response_keys=list(result.keys()))
-                    
-                    # ✅ Парсим ответ с учетом поля status
-                    status = result.get('status')
-                    
-                    # ✅ ЛОГИРУЕМ РАСПОЗНАННЫЙ СТАТУС
-                    logger.info("transcription.status.parsed",
-                               task_id=task_id,
-                               parsed_status=status)
-                    
-                    # ✅ Обработка статусов согласно API документации
-                    if status == 'ready':
-                        # Результат готов!
-                        logger.info("transcription.status.completed", task_id=task_id)
-                        return {
-                            'status': 'completed',
-                            'result': result,
-                            'api_status': status
-                        }
-                    elif status == 'waiting':
-                        # Еще обрабатывается
-                        logger.debug("transcription.status.processing", task_id=task_id)
-                        return {
-                            'status': 'processing',
-                            'result': None,
-                            'api_status': status
-                        }
-                    elif status == 'not found':
-                        # Задача не найдена
-                        logger.warning("transcription.status.not_found",
-                                      task_id=task_id)
-                        return {
-                            'status': 'error',
-                            'result': None,
-                            'error': 'Task not found',
-                            'api_status': status
-                        }
-                    elif status == 'failed':
-                        # Сбой при обработке
-                        error_msg = result.get('error') or 'Task processing failed'
-                        logger.warning("transcription.status.failed",
-                                      task_id=task_id,
-                                      error=error_msg)
-                        return {
-                            'status': 'error',
-                            'result': None,
-                            'error': error_msg,
-                            'api_status': status
-                        }
-                    else:
-                        # Неизвестный статус
-                        logger.warning("transcription.status.unknown",
-                                      task_id=task_id,
-                                      status=status)
-                        return {
-                            'status': 'unknown',
-                            'result': result,
-                            'api_status': status
-                        }
-                
-                elif response.status == 401:
-                    # ✅ ОБРАБОТКА 401 ТОЛЬКО ЕСЛИ АВТОРИЗАЦИЯ ВКЛЮЧЕНА
-                    if self.use_authorization:
-                        self.auth_token = None
-                        await self._authenticate(retry=True)
-                    
-                    raise aiohttp.ClientResponseError(
-                        request_info=response.request_info,
-                        history=response.history,
-                        status=response.status,
-                        message="Token expired or authentication required"
-                    )
-                else:
-                    text = await response.text()
-                    logger.warning("transcription.status.http_error",
-                                  task_id=task_id,
-                                  status=response.status,
-                                  response_text=text[:200])
-                    return {
-                        'status': 'error',
-                        'result': None,
-                        'error': f'HTTP {response.status}',
-                        'api_status': None
-                    }
-
-
-        except Exception as e:
-            logger.error("transcription.status.error",
-                        task_id=task_id,
-                        error=str(e))
-            return {
-                'status': 'error',
-                'result': None,
-                'error': str(e),
-                'api_status': None
-            }
-
-
-
-    async def poll_transcription_result(self, task_id: str, 
-                                       max_attempts: Optional[int] = None) -> Optional[Dict[str, Any]]:
-        """
-        Проверять статус обработки пока результат не будет готов.
-        
-        Параметры:
-        - task_id: ID задачи
-        - max_attempts: максимум попыток (по умолчанию 300 = 10 минут)
-        
-        Возвращает результат транскрипции или None если ошибка/таймаут.
-        """
-        if max_attempts is None:
-            max_attempts = self.max_polling_attempts
-        
-        logger.info("transcription.polling.starting",
-                   task_id=task_id,
-                   max_attempts=max_attempts,
-                   polling_interval=self.polling_interval,
-                   timeout_minutes=int((max_attempts * self.polling_interval) / 60))
-        
-        for attempt in range(1, max_attempts + 1):
-            try:
-                # ✅ ЛОГИРУЕМ НАЧАЛО ПОПЫТКИ
-                logger.debug("transcription.polling.attempt_start",
-                            task_id=task_id,
-                            attempt=attempt,
-                            max_attempts=max_attempts)
-                
-                status_info = await self.check_transcription_status(task_id)
-                
-                if not status_info:
-                    logger.warning("transcription.polling.no_response",
-                                  task_id=task_id,
-                                  attempt=attempt)
-                    await asyncio.sleep(self.polling_interval)
-                    continue
-                
-                status = status_info.get('status')
-                
-                # ✅ ЛОГИРУЕМ ПОЛУЧЕННЫЙ СТАТУС
-                logger.info("transcription.polling.status_received",
-                           task_id=task_id,
-                           attempt=attempt,
-                           status=status,
-                           api_status=status_info.get('api_status'))
-                
-                if status == 'completed':
-                    logger.info("transcription.polling.completed",
-                               task_id=task_id,
-                               attempt=attempt,
-                               total_seconds=int(attempt * self.polling_interval))
-                    return status_info.get('result')
-                
-                elif status == 'error':
-                    logger.error("transcription.polling.error",
-                                task_id=task_id,
-                                error=status_info.get('error'),
-                                api_status=status_info.get('api_status'))
-                    return None
-                
-                elif status == 'processing':
-                    # ✅ УЛУЧШЕННОЕ ЛОГИРОВАНИЕ
-                    if attempt % 5 == 0:
-                        logger.info("transcription.polling.still_processing",
-                                   task_id=task_id,
-                                   attempt=attempt,
-                                   elapsed_seconds=int(attempt * self.polling_interval))
-                    else:
-                        logger.debug("transcription.polling.processing_wait",
-                                    task_id=task_id,
-                                    attempt=attempt)
-                    
-                    if attempt < max_attempts:
-                        logger.debug("transcription.polling.sleeping",
-                                    task_id=task_id,
-                                    sleep_seconds=self.polling_interval)
-                        await asyncio.sleep(self.polling_interval)
-                        continue
-                    else:
-                        logger.error("transcription.polling.timeout",
-                                    task_id=task_id,
-                                    max_attempts=max_attempts,
-                                    timeout_seconds=int(max_attempts * self.polling_interval))
-                        return None
-                
-                else:
-                    # ⚠️ НЕИЗВЕСТНЫЙ СТАТУС
-                    logger.warning("transcription.polling.unexpected_status",
-                                  task_id=task_id,
-                                  status=status,
-                                  attempt=attempt,
-                                  full_status_info=status_info)
-                    
-                    # Неизвестный статус - пробуем продолжить
-                    if attempt < max_attempts:
-                        await asyncio.sleep(self.polling_interval)
-                        continue
-                    else:
-                        return None
-            
-            except Exception as e:
-                logger.error("transcription.polling.iteration_error",
-                            task_id=task_id,
-                            attempt=attempt,
-                            error=str(e))
-                await asyncio.sleep(self.polling_interval)
-        
-        logger.error("transcription.polling.max_attempts_exceeded",
-                    task_id=task_id,
-                    total_seconds=int(max_attempts * self.polling_interval))
-        return None
-
-
-
-    # ============ СИНХРОННАЯ ОБРАБОТКА (СОВМЕСТИМОСТЬ) ============
-
-
-    async def transcribe_audio(self, file_path: str) -> Dict[str, Any]:
-        """
-        Синхронная транскрипция (для совместимости).
-        
-        Внутренне использует асинхронный API:
-        1. Отправляет файл на асинхронную обработку (получает taskID)
-        2. Проверяет статус в цикле через GET /spr/result/{taskID}
-        3. Возвращает результат
-        """
-        try:
-            # ✅ Отправляем файл на асинхронную обработку
-            task_id = await self.submit_transcription_job(file_path)
-            
-            if not task_id:
-                logger.error("transcription.sync.submission_failed",
-                            file_path=file_path)
-                raise TranscriptionError("Failed to submit transcription job")
-            
-            logger.info("transcription.sync.job_submitted",
-                       file=os.path.basename(file_path),
-                       task_id=task_id)
-            
-            # ✅ Проверяем статус пока не будет готов
-            result = await self.poll_transcription_result(task_id)
-            
-            if result:
-                logger.info("transcription.sync.success",
-                           file=os.path.basename(file_path),
-                           task_id=task_id)
-                return result
-            else:
-                logger.error("transcription.sync.failed",
-                            file_path=file_path,
-                            task_id=task_id)
-                raise TranscriptionError(f"Transcription job {task_id} failed or timed out")
-        
-        except Exception as e:
-            logger.error("transcription.sync.error",
-                        file_path=file_path,
-                        error=str(e))
-            raise
-
-
-
-    def _get_file_extension(self, file_path: str) -> str:
-        """Определение MIME-типа по расширению файла"""
-        ext = os.path.splitext(file_path)[1].lower().lstrip('.')
-        mime_map = {
-            'mp3': 'mpeg',
-            'wav': 'wav',
-            'm4a': 'mp4',
-            'flac': 'flac',
-            'ogg': 'ogg',
-            'aac': 'aac'
-        }
-        return mime_map.get(ext, 'mpeg')
-
-
-
-    async def validate_connection(self) -> bool:
-        """Проверка соединения с сервисом транскрипции"""
-        try:
-            # ✅ ЕСЛИ АВТОРИЗАЦИЯ ОТКЛЮЧЕНА - ПРОСТО ВОЗВРАЩАЕМ TRUE
-            if not self.use_authorization:
-                logger.info("transcription.connection.validated_no_auth")
-                return True
-            
-            # ИНАЧЕ - ПРОВЕРЯЕМ АВТОРИЗАЦИЮ
-            if not self.auth_token and settings.LOGIN and settings.PASSWORD:
-                await self._authenticate(retry=False)
-                return True
-            elif self.auth_token:
-                return True
-            else:
-                logger.warning("transcription.service.no.credentials")
-                return False
-        except Exception as e:
-            logger.error("connection.validation.failed", error=str(e))
-            return False
-
-
-
-    async def process_audio_files(self, file_paths: List[str], semaphore: asyncio.Semaphore) -> List[bool]:
-        """Асинхронная обработка нескольких файлов с переданным семафором"""
-        tasks = [self.process_audio_file(file_path, semaphore) for file_path in file_paths]
-        results = await asyncio.gather(*tasks, return_exceptions=True)
-        
-        # Обрабатываем исключения
-        final_results = []
-        for result in results:
-            if isinstance(result, Exception):
-                logger.error("async_processing_error", error=str(result))
-                final_results.append(False)
-            else:
-                final_results.append(result)
-                
-        return final_results
-
-
-
-    async def process_audio_file(self, file_path: str, semaphore: asyncio.Semaphore) -> bool:
-        """Асинхронная обработка одного файла с переданным семафором"""
-        try:
-            # Используем переданный семафор
-            async with semaphore:
-                transcription_result = await self.transcribe_audio(file_path)
-            
-            return transcription_result is not None
-            
-        except Exception as e:
-            logger.error("file_processing_error", file_path=file_path, error=str(e))
-            return False
+import aiohttp
+import asyncio
+import base64
+import json
+import logging
+import os
+import random
+import time
+import uuid
+import orjson
+from aiohttp.helpers import content_disposition_header
+from functools import lru_cache
+from types import MappingProxyType
+from typing import Optional, Dict, Any, List, AsyncIterator, Tuple, Final
+from pathlib import Path
+from datetime import datetime
+
+
+
+try:
+    from config.settings import settings
+except ImportError:
+    from config.settings import settings
+
+
+
+from src.core.exceptions import TranscriptionError
+import structlog
+
+
+
+logger = structlog.get_logger()
+
+# Флаг авторизации читается один раз при импорте модуля
+_USE_AUTH: Final[bool] = settings.USE_AUTHORIZATION
+
+# stdlib-логгер модуля: по нему structlog (filter_by_level) решает, выводить ли
+# запись. Проверка уровня дешёвая и учитывает смену LOG_LEVEL на лету
+_stdlib_logger = logging.getLogger(__name__)
+
+# Сколько байт ответа API выводить в debug-лог
+_DEBUG_SNIPPET_BYTES = 1024
+
+
+def _debug_snippet(payload: Any) -> str:
+    """Ограниченный по размеру JSON-фрагмент ответа для debug-лога"""
+    return orjson.dumps(payload)[:_DEBUG_SNIPPET_BYTES].decode(errors="ignore")
+
+
+# Постоянные параметры запроса на транскрипцию
+_SUBMIT_PARAMS = {
+    "speakers": "1",
+    "speaker_counter": "0",
+    "async": "1",
+    "1": "1",
+    "punctuation": "0",
+    "normalization": "0",
+    "toxicity": "1",
+    "emotion": "1",
+    "voice_analyzer": "1",
+    "vad": "webrtc",
+    "classifiers": '{"smc":{"Скрипты1":{"correction":1,"confidenceThreshold":40}},"see":{"FIO":{"correction":1,"confidenceThreshold":40}}}'
+}
+
+
+# Расширение файла → подтип MIME audio/*
+_MIME_MAP = MappingProxyType({
+    'mp3': 'mpeg',
+    'wav': 'wav',
+    'm4a': 'mp4',
+    'flac': 'flac',
+    'ogg': 'ogg',
+    'aac': 'aac',
+})
+
+
+@lru_cache(maxsize=256)
+def _ext_lookup(ext: str) -> str:
+    """Подтип MIME по расширению (неизвестное расширение возвращается как есть)"""
+    return _MIME_MAP.get(ext, ext or 'mpeg')
+
+
+def _mime_for(filename: str) -> str:
+    """
+    Подтип MIME audio/* для файла.
+    
+    Args:
+        filename: Имя файла (например, "audio.mp3")
+    
+    Returns:
+        Подтип без "audio/" (например, "mpeg")
+    """
+    _, dot, ext = filename.rpartition('.')
+    # Точка должна быть в имени файла, а не в пути к нему
+    if not dot or '/' in ext:
+        ext = ''
+    return _ext_lookup(ext.lower())
+
+
+
+class TranscriptionService:
+    """Сервис для работы с API транскрипции с поддержкой асинхронной обработки"""
+    
+    def __init__(self):
+        self.session: Optional[aiohttp.ClientSession] = None
+        self._connector: Optional[aiohttp.TCPConnector] = None
+        self.max_retries = settings.API_MAX_RETRIES
+        
+        # ✅ ФЛАГ АВТОРИЗАЦИИ
+        self.use_authorization = _USE_AUTH
+        
+        # Multipart-тело submit: граница и часть с параметрами не меняются
+        # между запросами, поэтому кодируются один раз
+        self._boundary = uuid.uuid4().hex
+        self._submit_params = tuple(
+            (key.encode(), str(value).encode()) for key, value in _SUBMIT_PARAMS.items()
+        )
+        self._params_multipart_suffix = self._encode_params_multipart(self._submit_params)
+        self._base_submit_headers = {
+            "accept": "application/json",
+            "Content-Type": f"multipart/form-data; boundary={self._boundary}",
+        }
+        
+        # Фоновое обновление токена до истечения его срока
+        self._refresh_task: Optional[asyncio.Task] = None
+        
+        # Активные опросы: task_id → задача опроса, общая для всех ожидающих
+        self._active_polls: Dict[str, asyncio.Task] = {}
+        self._refresh_lock = asyncio.Lock()
+        self._token_refresh_at: Optional[float] = None
+        self._token_expires_at: Optional[float] = None
+        
+        # Токен задаётся после флага: setter пересобирает заголовки запросов
+        self.auth_token = settings.TRANSCRIPTION_ACCESS_TOKEN
+        
+        # ✅ ОПТИМИЗИРОВАННЫЕ ТАЙМАУТЫ
+        self.auth_timeout = aiohttp.ClientTimeout(total=60.0)
+        self.timeout = aiohttp.ClientTimeout(total=settings.TRANSCRIPTION_TIMEOUT)
+        # Загрузка файла может идти долго. Для проверки статуса короткие
+        # лимиты только на соединение и ожидание данных: зависший опрос
+        # обрывается за секунды, а большой ответ 'ready' успевает скачаться
+        self._submit_timeout = aiohttp.ClientTimeout(
+            total=settings.TRANSCRIPTION_TIMEOUT,
+            sock_read=settings.TRANSCRIPTION_TIMEOUT,
+        )
+        self._poll_timeout = aiohttp.ClientTimeout(
+            total=settings.TRANSCRIPTION_TIMEOUT,
+            connect=3,
+            sock_read=5,
+        )
+        
+        # Параметры опроса статуса: экспоненциальный рост интервала с jitter
+        self.base_interval = settings.TRANSCRIPTION_POLL_BASE_INTERVAL
+        self.max_interval = settings.TRANSCRIPTION_POLL_MAX_INTERVAL
+        self.jitter = settings.TRANSCRIPTION_POLL_JITTER
+        self.max_polling_seconds = settings.TRANSCRIPTION_POLL_MAX_SECONDS
+        
+        # Параметры авторизации
+        self.auth_max_retries = 5
+        self.auth_retry_delay = 5.0
+        
+        # Circuit breaker авторизации: после threshold неудач подряд
+        # запросы к сервису авторизации не выполняются cooldown секунд
+        self._auth_breaker = {
+            "failures": 0,
+            "threshold": 3,
+            "opened_at": float("-inf"),
+            "cooldown": 30.0,
+        }
+        
+        # Текущая авторизация, к которой присоединяются параллельные вызовы
+        self._auth_inflight: Optional[asyncio.Task] = None
+        
+        logger.info("transcription.service.configured",
+                   use_authorization=self.use_authorization)
+
+
+    def _encode_params_multipart(self, params: Tuple[Tuple[bytes, bytes], ...]) -> bytes:
+        """
+        Закодировать параметры API как хвост multipart/form-data тела.
+        
+        Хвост идёт сразу после содержимого файла и включает
+        закрывающую границу.
+        """
+        boundary = self._boundary.encode()
+        parts = []
+        for key, value in params:
+            parts.append(
+                b"\r\n--" + boundary + b"\r\n"
+                b'Content-Disposition: form-data; name="' + key + b'"\r\n\r\n'
+                + value
+            )
+        parts.append(b"\r\n--" + boundary + b"--\r\n")
+        return b"".join(parts)
+
+
+    def _file_multipart_prefix(self, filename: str) -> bytes:
+        """Заголовок multipart-части с файлом (поле wav)"""
+        # Имя файла кодируется так же, как в aiohttp.FormData: percent-encoding
+        # убирает кавычки, CR/LF и не-ASCII символы из заголовка части
+        disposition = content_disposition_header(
+            "form-data", params={"name": "wav", "filename": filename}
+        )
+        return (
+            f"--{self._boundary}\r\n"
+            f"Content-Disposition: {disposition}\r\n"
+            f"Content-Type: audio/{_mime_for(filename)}\r\n\r\n"
+        ).encode()
+
+
+    @staticmethod
+    async def _multipart_body(
+        prefix: bytes,
+        file_bytes: Optional[bytes],
+        file_stream: Optional[AsyncIterator[bytes]],
+        suffix: bytes,
+    ) -> AsyncIterator[bytes]:
+        """Тело запроса: заголовок части, содержимое файла, параметры"""
+        yield prefix
+        if file_stream is not None:
+            async for chunk in file_stream:
+                yield chunk
+        else:
+            # memoryview: байты файла уходят в сокет без промежуточных копий
+            yield memoryview(file_bytes)
+        yield suffix
+
+
+    @property
+    def auth_token(self) -> Optional[str]:
+        """Текущий токен доступа"""
+        return self._auth_token
+
+
+    @auth_token.setter
+    def auth_token(self, token: Optional[str]) -> None:
+        """Установить токен и пересобрать заголовки для submit/status запросов"""
+        self._auth_token = token
+        headers = {"accept": "application/json"}
+        if self.use_authorization and token:
+            headers["x-access-token"] = token
+        self._auth_headers: Dict[str, str] = headers
+        self._submit_headers: Dict[str, str] = {**self._base_submit_headers, **headers}
+        
+        # Токен считается устаревшим (stale) за 5% его жизни до истечения
+        if token:
+            issued_at = time.time()
+            expires_at = self._token_exp(token) or issued_at + settings.TRANSCRIPTION_TOKEN_TTL
+            self._token_expires_at = expires_at
+            self._token_refresh_at = expires_at - max(0.0, expires_at - issued_at) * 0.05
+        else:
+            self._token_expires_at = None
+            self._token_refresh_at = None
+
+
+    @staticmethod
+    def _token_exp(token: str) -> Optional[float]:
+        """Claim exp из JWT (без проверки подписи) или None"""
+        try:
+            payload = token.split(".")[1]
+            payload += "=" * (-len(payload) % 4)
+            exp = json.loads(base64.urlsafe_b64decode(payload)).get("exp")
+            return float(exp) if exp is not None else None
+        except (IndexError, ValueError, TypeError, AttributeError):
+            return None
+
+
+    def _token_state(self) -> str:
+        """Состояние токена: fresh, stale или expired"""
+        if not self.auth_token or self._token_expires_at is None:
+            return "expired"
+        now = time.time()
+        if now >= self._token_expires_at:
+            return "expired"
+        if now >= self._token_refresh_at:
+            return "stale"
+        return "fresh"
+
+
+    async def _token_refresher_loop(self) -> None:
+        """
+        Фоновое обновление токена.
+        
+        Токен обновляется, как только становится stale, поэтому запросы
+        почти никогда не ждут авторизацию. Ответ 401 остаётся запасным путём.
+        """
+        while True:
+            try:
+                if self._token_refresh_at is not None:
+                    # Не чаще раза в auth_retry_delay: токен с истёкшим сроком
+                    # (рассинхрон часов, короткое время жизни) не должен
+                    # приводить к повторному логину без паузы
+                    await asyncio.sleep(max(self.auth_retry_delay, self._token_refresh_at - time.time()))
+                else:
+                    # Токена нет (например, авторизация при старте не удалась)
+                    await asyncio.sleep(self.auth_retry_delay)
+                
+                async with self._refresh_lock:
+                    # Токен могли обновить, пока мы спали (например, после 401)
+                    if self._token_state() == "fresh":
+                        continue
+                    logger.info("transcription.token.refreshing",
+                               state=self._token_state())
+                    await self._authenticate(retry=True)
+            
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning("transcription.token.refresh_failed",
+                              error=str(e),
+                              error_type=type(e).__name__)
+                await asyncio.sleep(self.auth_retry_delay)
+
+
+
+    async def start(self):
+        """Инициализация сервиса - авторизация опциональна"""
+        # Сессия общая для всех worker'ов - повторный вызов её не пересоздаёт
+        if self.session and not self.session.closed:
+            return
+
+        # Один пул соединений на все submit/poll запросы к сервису транскрипции
+        self._connector = aiohttp.TCPConnector(
+            limit=200,
+            limit_per_host=64,
+            keepalive_timeout=75,
+            ttl_dns_cache=300,
+            enable_cleanup_closed=True,
+        )
+        self.session = aiohttp.ClientSession(
+            connector=self._connector,
+            timeout=self.timeout,
+            cookie_jar=aiohttp.DummyCookieJar(),
+            json_serialize=lambda obj: orjson.dumps(obj).decode(),
+        )
+        
+        logger.info("transcription.service.starting",
+                   mode="with_auth" if self.use_authorization else "no_auth")
+        
+        # ✅ АВТОРИЗАЦИЯ ТОЛЬКО ЕСЛИ ВКЛЮЧЕНА
+        if self.use_authorization:
+            if not self.auth_token and settings.LOGIN and settings.PASSWORD:
+                try:
+                    logger.info("transcription.service.attempting_authentication_on_startup")
+                    await self._authenticate(retry=True)
+                    logger.info("transcription.service.authenticated_on_startup")
+                except Exception as e:
+                    logger.warning("transcription.service.auth_failed_on_startup",
+                                  error=str(e),
+                                  error_type=type(e).__name__,
+                                  message="Will retry authentication on first transcription request")
+            
+            # Без логина/пароля обновлять токен нечем
+            if settings.LOGIN and settings.PASSWORD:
+                self._refresh_task = asyncio.create_task(self._token_refresher_loop())
+        else:
+            logger.info("transcription.service.auth_disabled")
+
+
+
+    async def stop(self):
+        """Остановка сервиса"""
+        # Опросы защищены shield от отмены ожидающих - отменяем их явно
+        for poll in list(self._active_polls.values()):
+            poll.cancel()
+        
+        if self._refresh_task:
+            self._refresh_task.cancel()
+            try:
+                await self._refresh_task
+            except asyncio.CancelledError:
+                pass
+            self._refresh_task = None
+        
+        if self.session:
+            # Сессия владеет коннектором и закрывает его сама
+            await self.session.close()
+            self.session = None
+            self._connector = None
+            logger.info("transcription.service.stopped")
+
+
+
+    async def _authenticate(self, retry: bool = True) -> str:
+        """
+        Асинхронная авторизация в сервисе транскрипции.
+        
+        Пропускается если USE_AUTHORIZATION=False
+        """
+        # ✅ ВЫХОД ЕСЛИ АВТОРИЗАЦИЯ ОТКЛЮЧЕНА
+        if not self.use_authorization:
+            logger.info("transcription.auth.skipped_auth_disabled")
+            return None
+        
+        # Single-flight: параллельные вызовы ждут одну и ту же авторизацию.
+        # Проверка и запуск без await между ними - атомарны в цикле событий
+        if self._auth_inflight is None:
+            self._auth_inflight = asyncio.create_task(self._run_authentication(retry))
+            self._auth_inflight.add_done_callback(self._clear_auth_inflight)
+        else:
+            logger.debug("authentication.joining_inflight")
+        
+        # shield: отмена одного из ожидающих не прерывает авторизацию для остальных
+        return await asyncio.shield(self._auth_inflight)
+
+
+
+    def _clear_auth_inflight(self, task: asyncio.Task) -> None:
+        """Сбросить завершившуюся авторизацию, чтобы следующий вызов начал новую"""
+        if self._auth_inflight is task:
+            self._auth_inflight = None
+        # Забрать исключение, даже если все ожидающие были отменены
+        if not task.cancelled():
+            task.exception()
+
+
+
+    async def _run_authentication(self, retry: bool) -> str:
+        """Авторизация с учётом circuit breaker"""
+        # Circuit breaker: сервис авторизации недоступен - не ходим в сеть
+        breaker = self._auth_breaker
+        if time.monotonic() - breaker["opened_at"] < breaker["cooldown"]:
+            raise TranscriptionError("auth service unavailable")
+        
+        try:
+            token = await self._authenticate_with_retries(retry)
+        except TranscriptionError:
+            breaker["failures"] += 1
+            if breaker["failures"] >= breaker["threshold"]:
+                breaker["opened_at"] = time.monotonic()
+                logger.warning("authentication.circuit_opened",
+                              failures=breaker["failures"],
+                              cooldown=breaker["cooldown"])
+            raise
+        
+        breaker["failures"] = 0
+        breaker["opened_at"] = float("-inf")
+        return token
+
+
+
+    async def _authenticate_with_retries(self, retry: bool) -> str:
+        """Запрос токена с повторами при таймаутах, ошибках соединения и 5xx"""
+        max_retries = self.auth_max_retries if retry else 1
+        
+        logger.info("authentication.starting", max_retries=max_retries)
+        
+        for attempt in range(1, max_retries + 1):
+            try:
+                data = {
+                    'username': settings.LOGIN,
+                    'password': settings.PASSWORD
+                }
+                
+                headers = {
+                    'accept': 'application/json',
+                    'Content-Type': 'application/x-www-form-urlencoded'
+                }
+
+
+                logger.info("authentication.attempt.sending",
+                           attempt=attempt,
+                           max_retries=max_retries,
+                           timeout=self.auth_timeout.total)
+
+
+                async with self.session.post(
+                    settings.AUTHORIZATION_SERVICE_URL,
+                    data=data,
+                    headers=headers,
+                    timeout=self.auth_timeout
+                ) as response:
+                    if response.status == 200:
+                        response_body = orjson.loads(await response.read())
+                        access_token = response_body.get("x-access-token")
+                        if access_token:
+                            self.auth_token = access_token
+                            logger.info("authentication.successful", 
+                                       token_prefix=access_token[:10] + "...",
+                                       attempt=attempt)
+                            return access_token
+                        else:
+                            raise TranscriptionError("x-access-token not found in response")
+                    else:
+                        text = await response.text()
+                        logger.error("authentication.failed", 
+                                   status_code=response.status, 
+                                   response_text=text[:200],
+                                   attempt=attempt)
+                        raise aiohttp.ClientResponseError(
+                            request_info=response.request_info,
+                            history=response.history,
+                            status=response.status,
+                            message=f"Authorization failed: {text[:200]}"
+                        )
+                        
+            except asyncio.TimeoutError as e:
+                logger.warning("authentication.timeout",
+                              attempt=attempt,
+                              max_retries=max_retries,
+                              timeout=self.auth_timeout.total,
+                              error=str(e))
+                
+                if attempt < max_retries:
+                    delay = self.auth_retry_delay * (2 ** (attempt - 1))
+                    delay = min(delay, 60.0) * random.uniform(0.5, 1.0)
+                    
+                    logger.info("authentication.retrying_after_timeout", 
+                               attempt=attempt,
+                               next_delay=delay)
+                    await asyncio.sleep(delay)
+                    continue
+                else:
+                    logger.error("authentication.failed_after_timeout_retries",
+                               max_retries=max_retries)
+                    raise TranscriptionError(f"Authentication timeout after {max_retries} attempts: {e}")
+            
+            except aiohttp.ClientConnectorError as e:
+                logger.warning("authentication.connection_error",
+                              attempt=attempt,
+                              max_retries=max_retries,
+                              error=str(e))
+                
+                if attempt < max_retries:
+                    delay = self.auth_retry_delay * (2 ** (attempt - 1))
+                    delay = min(delay, 60.0) * random.uniform(0.5, 1.0)
+                    
+                    logger.info("authentication.retrying_after_connection_error", 
+                               attempt=attempt,
+                               next_delay=delay)
+                    await asyncio.sleep(delay)
+                    continue
+                else:
+                    logger.error("authentication.failed_after_connection_error_retries",
+                               max_retries=max_retries)
+                    raise TranscriptionError(f"Connection error after {max_retries} attempts: {e}")
+            
+            except aiohttp.ClientResponseError as e:
+                logger.error("authentication.response_error",
+                           status=e.status,
+                           attempt=attempt,
+                           error=str(e))
+                
+                if attempt < max_retries and e.status >= 500:
+                    delay = self.auth_retry_delay * attempt
+                    delay = min(delay, 60.0) * random.uniform(0.5, 1.0)
+                    
+                    logger.info("authentication.retrying_after_server_error", 
+                               attempt=attempt,
+                               next_delay=delay,
+                               status=e.status)
+                    await asyncio.sleep(delay)
+                    continue
+                else:
+                    raise TranscriptionError(f"Authentication error: {e}")
+                
+            except Exception as e:
+                logger.error("authentication.unexpected_error", 
+                           error=str(e), 
+                           error_type=type(e).__name__,
+                           attempt=attempt)
+                raise TranscriptionError(f"Authentication error: {e}")
+        
+        raise TranscriptionError(f"Authentication failed after {max_retries} attempts")
+
+
+
+    # ============ АСИНХРОННАЯ ОБРАБОТКА ============
+
+
+    async def submit_transcription_job(
+        self,
+        file_bytes: Optional[bytes] = None,
+        filename: str = "",
+        file_stream: Optional[AsyncIterator[bytes]] = None,
+        size: Optional[int] = None,
+    ) -> Optional[str]:
+        """
+        Отправить файл аудио на транскрипцию.
+        
+        Args:
+            file_bytes: Байты аудиофайла (напрямую из MinIO)
+            filename: Имя файла (например, "audio.mp3")
+            file_stream: Асинхронный поток частей файла (вместо file_bytes)
+            size: Размер файла в байтах (для логов при потоковой отправке)
+        
+        Returns:
+            task_id: ID задачи транскрипции или None
+        """
+        task_id = None
+        
+        try:
+            # Размер потока без явного size неизвестен
+            size_known = size is not None or file_stream is None
+            if size is None:
+                size = len(file_bytes) if file_bytes is not None else 0
+            file_size_mb = size / 1024 / 1024
+            logger.info(
+                "transcription.async_job.submitting",
+                file=filename,
+                file_size_mb=round(file_size_mb, 2)
+            )
+            
+            # ✅ Аутентификация если нужна
+            if _USE_AUTH and not self.auth_token:
+                logger.info("transcription.no_token_attempting_auth")
+                await self._authenticate(retry=True)
+            
+            # ✅ Multipart-тело собирается вручную: файл передаётся как есть,
+            # параметры уже закодированы в _params_multipart_suffix
+            prefix = self._file_multipart_prefix(filename)
+            suffix = self._params_multipart_suffix
+            data = self._multipart_body(prefix, file_bytes, file_stream, suffix)
+            
+            headers = self._submit_headers
+            if size_known:
+                headers = dict(headers)
+                # Известная длина - без chunked transfer-encoding
+                headers["Content-Length"] = str(len(prefix) + size + len(suffix))
+            
+            # ✅ POST запрос с байтами (не с файлом!)
+            async with self.session.post(
+                settings.TRANSCRIPTION_SERVICE_URL,
+                data=data,
+                headers=headers,
+                timeout=self._submit_timeout
+            ) as response:
+                if response.status == 200:
+                    result = orjson.loads(await response.read())
+                    
+                    if _stdlib_logger.isEnabledFor(logging.DEBUG):
+                        logger.debug(
+                            "transcription.submit.raw_response",
+                            job_response=_debug_snippet(result)
+                        )
+                    
+                    task_id = result.get("taskID")
+                    if not task_id:
+                        logger.error(
+                            "transcription.async_job.no_id_in_response",
+                            response=result
+                        )
+                        return None
+                    
+                    logger.info(
+                        "transcription.async_job.submitted",
+                        file=filename,
+                        task_id=task_id,
+                        file_size_mb=round(file_size_mb, 2)
+                    )
+                    
+                    return task_id
+                
+                elif response.status == 401:
+                    # Token истек
+                    if _USE_AUTH:
+                        logger.warning(
+                            "transcription.token.expired",
+                            file=filename
+                        )
+                        self.auth_token = None
+                        await self._authenticate(retry=True)
+                        raise aiohttp.ClientResponseError(
+                            request_info=response.request_info,
+                            history=response.history,
+                            status=response.status,
+                            message="Token expired or authentication required"
+                        )
+                    else:
+                        text = await response.text()
+                        logger.error(
+                            "transcription.async_job.api_error",
+                            file=filename,
+                            status_code=response.status,
+                            response_text=text[:200]
+                        )
+                        raise aiohttp.ClientResponseError(
+                            request_info=response.request_info,
+                            history=response.history,
+                            status=response.status,
+                            message=text[:200]
+                        )
+                
+                else:
+                    text = await response.text()
+                    logger.error(
+                        "transcription.async_job.api_error",
+                        file=filename,
+                        status_code=response.status,
+                        response_text=text[:200]
+                    )
+                    raise aiohttp.ClientResponseError(
+                        request_info=response.request_info,
+                        history=response.history,
+                        status=response.status,
+                        message=text[:200]
+                    )
+        
+        except Exception as e:
+            logger.error(
+                "transcription.async_job.submission.error",
+                error=str(e),
+                file=filename
+            )
+            return None
+
+
+    async def check_transcription_status(self, task_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Проверить статус обработки по taskID.
+        
+        Использует endpoint: GET /spr/result/{taskID}
+        
+        Статусы:
+        - ready: готово (есть результат)
+        - waiting: ожидание (еще обрабатывается)
+        - not found: не найдена
+        - failed: сбой
+        
+        Возвращает словарь с информацией о статусе или None при таймауте
+        и сетевой ошибке (опрос повторит проверку).
+        """
+        try:
+            logger.debug("transcription.status.checking", task_id=task_id)
+            
+            # ✅ АВТОРИЗАЦИЯ ТОЛЬКО ЕСЛИ НУЖНА
+            if _USE_AUTH and not self.auth_token:
+                await self._authenticate(retry=True)
+            
+            # ✅ ПРАВИЛЬНЫЙ ENDPOINT для получения результата
+            result_url = f"{settings.TRANSCRIPTION_SERVICE_BY_JOB_URL}/{task_id}"
+            logger.debug("transcription.status.request_url", url=result_url)
+            
+            async with self.session.get(
+                result_url,
+                headers=self._auth_headers,
+                timeout=self._poll_timeout
+            ) as response:
+                
+                if response.status == 200:
+                    result = orjson.loads(await response.read())
+                    
+                    # Ответ с результатом может весить сотни КБ: собираем
+                    # debug-данные, только если debug-уровень включён
+                    if _stdlib_logger.isEnabledFor(logging.DEBUG):
+                        logger.debug("transcription.status.raw_response",
+                                    task_id=task_id,
+                                    status_response=_debug_snippet(result),
+                                    response_keys=tuple(result))
+                    
+                    # ✅ Парсим ответ с учетом поля status
+                    status = result.get('status')
+                    
+                    # ✅ ЛОГИРУЕМ РАСПОЗНАННЫЙ СТАТУС
+                    logger.info("transcription.status.parsed",
+                               task_id=task_id,
+                               parsed_status=status)
+                    
+                    # ✅ Обработка статусов согласно API документации
+                    if status == 'ready':
+                        # Результат готов!
+                        logger.info("transcription.status.completed", task_id=task_id)
+                        return {
+                            'status': 'completed',
+                            'result': result,
+                            'api_status': status
+                        }
+                    elif status == 'waiting':
+                        # Еще обрабатывается
+                        logger.debug("transcription.status.processing", task_id=task_id)
+                        return {
+                            'status': 'processing',
+                            'result': None,
+                            'api_status': status,
+                            'next_poll_after': self._parse_poll_hint(response, result)
+                        }
+                    elif status == 'not found':
+                        # Задача не найдена
+                        logger.warning("transcription.status.not_found",
+                                      task_id=task_id)
+                        return {
+                            'status': 'error',
+                            'result': None,
+                            'error': 'Task not found',
+                            'api_status': status
+                        }
+                    elif status == 'failed':
+                        # Сбой при обработке
+                        error_msg = result.get('error') or 'Task processing failed'
+                        logger.warning("transcription.status.failed",
+                                      task_id=task_id,
+                                      error=error_msg)
+                        return {
+                            'status': 'error',
+                            'result': None,
+                            'error': error_msg,
+                            'api_status': status
+                        }
+                    else:
+                        # Неизвестный статус
+                        logger.warning("transcription.status.unknown",
+                                      task_id=task_id,
+                                      status=status)
+                        return {
+                            'status': 'unknown',
+                            'result': result,
+                            'api_status': status
+                        }
+                
+                elif response.status == 401:
+                    # ✅ ОБРАБОТКА 401 ТОЛЬКО ЕСЛИ АВТОРИЗАЦИЯ ВКЛЮЧЕНА
+                    if _USE_AUTH:
+                        self.auth_token = None
+                        await self._authenticate(retry=True)
+                    
+                    raise aiohttp.ClientResponseError(
+                        request_info=response.request_info,
+                        history=response.history,
+                        status=response.status,
+                        message="Token expired or authentication required"
+                    )
+                else:
+                    text = await response.text()
+                    logger.warning("transcription.status.http_error",
+                                  task_id=task_id,
+                                  status=response.status,
+                                  response_text=text[:200])
+                    return {
+                        'status': 'error',
+                        'result': None,
+                        'error': f'HTTP {response.status}',
+                        'api_status': None
+                    }
+
+
+        except (asyncio.TimeoutError, aiohttp.ClientError) as e:
+            # Временный сбой - не окончательная ошибка задачи
+            logger.warning("transcription.status.transport_error",
+                          task_id=task_id,
+                          error=str(e),
+                          error_type=type(e).__name__)
+            return None
+        
+        except Exception as e:
+            logger.error("transcription.status.error",
+                        task_id=task_id,
+                        error=str(e))
+            return {
+                'status': 'error',
+                'result': None,
+                'error': str(e),
+                'api_status': None
+            }
+
+
+
+    @staticmethod
+    def _parse_poll_hint(response, result: Dict[str, Any]) -> Optional[float]:
+        """
+        Подсказка сервера, когда проверять статус снова (секунды).
+        
+        Берётся из заголовка Retry-After или поля estimated_seconds_remaining.
+        Возвращает None, если сервер подсказки не дал.
+        """
+        for value in (response.headers.get("Retry-After"),
+                      result.get("estimated_seconds_remaining")):
+            if value is None:
+                continue
+            try:
+                seconds = float(value)
+            except (TypeError, ValueError):
+                # Retry-After в формате HTTP-date не поддерживаем
+                continue
+            if seconds > 0:
+                return seconds
+        return None
+
+
+    def _compute_backoff(self, step: int) -> float:
+        """
+        Интервал до следующей проверки статуса.
+
+        Экспоненциальный рост от base_interval до max_interval,
+        с "full jitter" - чтобы задачи, завершившиеся одновременно,
+        не опрашивали API синхронно.
+        """
+        delay = min(self.max_interval, self.base_interval * (2 ** step))
+        if self.jitter:
+            delay *= random.uniform(0.5, 1.0)
+        return delay
+
+
+    async def poll_transcription_result(self, task_id: str, 
+                                       max_seconds: Optional[float] = None,
+                                       first_status: Optional[Dict[str, Any]] = None) -> Optional[Dict[str, Any]]:
+        """
+        Проверять статус обработки пока результат не будет готов.
+        
+        Интервал между проверками растёт экспоненциально (см. _compute_backoff),
+        поэтому ограничение задаётся временем, а не числом попыток.
+        
+        Параметры:
+        - task_id: ID задачи
+        - max_seconds: максимальное время ожидания (по умолчанию max_polling_seconds)
+        - first_status: уже полученный результат первой проверки статуса
+          (используется вместо первого запроса)
+        
+        Параллельные вызовы для одного task_id ждут один и тот же опрос.
+        
+        Возвращает результат транскрипции или None если ошибка/таймаут.
+        """
+        poll = self._active_polls.get(task_id)
+        if poll is None:
+            poll = asyncio.create_task(self._poll_once(task_id, max_seconds, first_status))
+            self._active_polls[task_id] = poll
+            poll.add_done_callback(lambda _: self._active_polls.pop(task_id, None))
+        else:
+            logger.debug("transcription.polling.joining_active", task_id=task_id)
+        
+        # shield: отмена одного из ожидающих не прерывает опрос для остальных
+        return await asyncio.shield(poll)
+
+
+    async def _poll_once(self, task_id: str,
+                         max_seconds: Optional[float],
+                         first_status: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+        """Цикл опроса статуса одной задачи (см. poll_transcription_result)"""
+        if max_seconds is None:
+            max_seconds = self.max_polling_seconds
+        
+        logger.info("transcription.polling.starting",
+                   task_id=task_id,
+                   max_seconds=max_seconds,
+                   base_interval=self.base_interval,
+                   max_interval=self.max_interval)
+        
+        started = time.monotonic()
+        deadline = started + max_seconds
+        attempt = 0
+        step = 0
+        last_status = None
+        
+        while time.monotonic() < deadline:
+            attempt += 1
+            attempt_started = time.monotonic()
+            try:
+                # ✅ ЛОГИРУЕМ НАЧАЛО ПОПЫТКИ
+                logger.debug("transcription.polling.attempt_start",
+                            task_id=task_id,
+                            attempt=attempt)
+                
+                if first_status is not None:
+                    status_info, first_status = first_status, None
+                else:
+                    status_info = await self.check_transcription_status(task_id)
+                
+                if not status_info:
+                    logger.warning("transcription.polling.no_response",
+                                  task_id=task_id,
+                                  attempt=attempt)
+                    status = None
+                else:
+                    status = status_info.get('status')
+                    
+                    # ✅ ЛОГИРУЕМ ПОЛУЧЕННЫЙ СТАТУС
+                    logger.info("transcription.polling.status_received",
+                               task_id=task_id,
+                               attempt=attempt,
+                               status=status,
+                               api_status=status_info.get('api_status'))
+                
+                if status == 'completed':
+                    logger.info("transcription.polling.completed",
+                               task_id=task_id,
+                               attempt=attempt,
+                               total_seconds=int(time.monotonic() - started))
+                    return status_info.get('result')
+                
+                elif status == 'error':
+                    logger.error("transcription.polling.error",
+                                task_id=task_id,
+                                error=status_info.get('error'),
+                                api_status=status_info.get('api_status'))
+                    return None
+                
+                elif status == 'processing':
+                    # ✅ УЛУЧШЕННОЕ ЛОГИРОВАНИЕ
+                    if attempt % 5 == 0:
+                        logger.info("transcription.polling.still_processing",
+                                   task_id=task_id,
+                                   attempt=attempt,
+                                   elapsed_seconds=int(time.monotonic() - started))
+                    else:
+                        logger.debug("transcription.polling.processing_wait",
+                                    task_id=task_id,
+                                    attempt=attempt)
+                
+                elif status is not None:
+                    # ⚠️ НЕИЗВЕСТНЫЙ СТАТУС - пробуем продолжить
+                    logger.warning("transcription.polling.unexpected_status",
+                                  task_id=task_id,
+                                  status=status,
+                                  attempt=attempt,
+                                  full_status_info=status_info)
+            
+            except Exception as e:
+                logger.error("transcription.polling.iteration_error",
+                            task_id=task_id,
+                            attempt=attempt,
+                            error=str(e))
+                status = None
+            
+            # Смена статуса - начинаем рост интервала заново
+            if status != last_status:
+                step = 0
+                last_status = status
+            
+            # Подсказка сервера приоритетнее собственного backoff
+            hint = status_info.get('next_poll_after') if status == 'processing' else None
+            if hint:
+                delay = hint
+            else:
+                # Время самой проверки уже входит в интервал между проверками
+                delay = self._compute_backoff(step) - (time.monotonic() - attempt_started)
+            delay = min(delay, deadline - time.monotonic())
+            # Рост останавливается на max_interval - step не растёт без предела
+            if self.base_interval * (2 ** step) < self.max_interval:
+                step += 1
+            
+            if delay <= 0:
+                # Проверка заняла весь интервал - только уступить цикл событий
+                await asyncio.sleep(0)
+                continue
+            
+            logger.debug("transcription.polling.sleeping",
+                        task_id=task_id,
+                        sleep_seconds=round(delay, 2))
+            await asyncio.sleep(delay)
+        
+        logger.error("transcription.polling.timeout",
+                    task_id=task_id,
+                    attempts=attempt,
+                    timeout_seconds=int(max_seconds))
+        return None
+
+
+
+    # ============ СИНХРОННАЯ ОБРАБОТКА (СОВМЕСТИМОСТЬ) ============
+
+
+    async def transcribe_audio(self, file_path: str) -> Dict[str, Any]:
+        """
+        Синхронная транскрипция (для совместимости).
+        
+        Внутренне использует асинхронный API:
+        1. Отправляет файл на асинхронную обработку (получает taskID)
+        2. Проверяет статус в цикле через GET /spr/result/{taskID}
+        3. Возвращает результат
+        """
+        try:
+            # ✅ Отправляем файл на асинхронную обработку
+            task_id = await self.submit_transcription_job(file_path)
+            
+            if not task_id:
+                logger.error("transcription.sync.submission_failed",
+                            file_path=file_path)
+                raise TranscriptionError("Failed to submit transcription job")
+            
+            # Первая проверка стартует сразу, без паузы перед опросом -
+            # короткие записи могут быть готовы уже к этому моменту
+            first_check = asyncio.create_task(self.check_transcription_status(task_id))
+            
+            logger.info("transcription.sync.job_submitted",
+                       file=os.path.basename(file_path),
+                       task_id=task_id)
+            
+            # ✅ Проверяем статус пока не будет готов
+            result = await self.poll_transcription_result(
+                task_id, first_status=await first_check
+            )
+            
+            if result:
+                logger.info("transcription.sync.success",
+                           file=os.path.basename(file_path),
+                           task_id=task_id)
+                return result
+            else:
+                logger.error("transcription.sync.failed",
+                            file_path=file_path,
+                            task_id=task_id)
+                raise TranscriptionError(f"Transcription job {task_id} failed or timed out")
+        
+        except Exception as e:
+            logger.error("transcription.sync.error",
+                        file_path=file_path,
+                        error=str(e))
+            raise
+
+
+
+    async def validate_connection(self) -> bool:
+        """Проверка соединения с сервисом транскрипции"""
+        try:
+            # ✅ ЕСЛИ АВТОРИЗАЦИЯ ОТКЛЮЧЕНА - ПРОСТО ВОЗВРАЩАЕМ TRUE
+            if not self.use_authorization:
+                logger.info("transcription.connection.validated_no_auth")
+                return True
+            
+            # ИНАЧЕ - ПРОВЕРЯЕМ АВТОРИЗАЦИЮ
+            if not self.auth_token and settings.LOGIN and settings.PASSWORD:
+                await self._authenticate(retry=False)
+                return True
+            elif self.auth_token:
+                return True
+            else:
+                logger.warning("transcription.service.no.credentials")
+                return False
+        except Exception as e:
+            logger.error("connection.validation.failed", error=str(e))
+            return False
+
+
+
+    async def process_audio_files(self, file_paths: List[str], semaphore: asyncio.Semaphore) -> List[bool]:
+        """Асинхронная обработка нескольких файлов с переданным семафором"""
+        tasks = [self.process_audio_file(file_path, semaphore) for file_path in file_paths]
+        results = await asyncio.gather(*tasks, return_exceptions=True)
+        
+        # Обрабатываем исключения
+        final_results = []
+        for result in results:
+            if isinstance(result, Exception):
+                logger.error("async_processing_error", error=str(result))
+                final_results.append(False)
+            else:
+                final_results.append(result)
+                
+        return final_results
+
+
+
+    async def process_audio_file(self, file_path: str, semaphore: asyncio.Semaphore) -> bool:
+        """Асинхронная обработка одного файла с переданным семафором"""
+        try:
+            # Используем переданный семафор
+            async with semaphore:
+                transcription_result = await self.transcribe_audio(file_path)
+            
+            return transcription_result is not None
+            
+        except Exception as e:
+            logger.error("file_processing_error", file_path=file_path, error=str(e))
+            return False
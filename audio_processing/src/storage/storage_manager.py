@@ -1,7 +1,7 @@
 import asyncio
 import json
 import io
-from typing import Optional, List, Dict, Any, BinaryIO
+from typing import Optional, List, Dict, Any, BinaryIO, AsyncIterator
 from pathlib import Path
 from datetime import datetime
 from abc import ABC, abstractmethod
@@ -57,6 +57,25 @@ class StorageBackend(ABC):
         """Получение содержимого файла"""
         pass
 
+    @abstractmethod
+    async def get_file_size(
+        self, 
+        bucket: str, 
+        object_name: str
+    ) -> Optional[int]:
+        """Получение размера файла без чтения содержимого"""
+        pass
+
+    @abstractmethod
+    def iter_file_chunks(
+        self, 
+        bucket: str, 
+        object_name: str,
+        chunk_size: int = 1 << 20
+    ) -> AsyncIterator[bytes]:
+        """Потоковое чтение файла частями по chunk_size байт"""
+        pass
+
     @abstractmethod
     async def list_files(
         self, 
@@ -276,6 +295,63 @@ class MinIOStorageBackend(StorageBackend):
             )
             return None
 
+    async def get_file_size(
+        self, 
+        bucket: str, 
+        object_name: str
+    ) -> Optional[int]:
+        """Получение размера объекта через stat_object"""
+        if not self.client:
+            return None
+
+        try:
+            loop = asyncio.get_event_loop()
+            
+            stat = await loop.run_in_executor(
+                None,
+                lambda: self.client.stat_object(bucket, object_name)
+            )
+            return stat.size
+        except S3Error as e:
+            logger.error(
+                "file.stat.failed",
+                bucket=bucket,
+                object_name=object_name,
+                error=str(e)
+            )
+            return None
+
+    async def iter_file_chunks(
+        self, 
+        bucket: str, 
+        object_name: str,
+        chunk_size: int = 1 << 20
+    ) -> AsyncIterator[bytes]:
+        """Потоковое чтение объекта из MinIO частями"""
+        if not self.client:
+            return
+
+        loop = asyncio.get_event_loop()
+        
+        response = await loop.run_in_executor(
+            None,
+            lambda: self.client.get_object(bucket, object_name)
+        )
+        
+        try:
+            while True:
+                chunk = await loop.run_in_executor(
+                    None,
+                    response.read,
+                    chunk_size
+                )
+                if not chunk:
+                    break
+                yield chunk
+        finally:
+            response.close()
+            response.release_conn()
+
     async def list_files(
         self, 
         bucket: str, 
@@ -494,6 +570,44 @@ class LocalStorageBackend(StorageBackend):
             )
             return None
 
+    async def get_file_size(
+        self, 
+        bucket: str, 
+        object_name: str
+    ) -> Optional[int]:
+        """Получение размера файла"""
+        try:
+            return (Path(bucket) / object_name).stat().st_size
+        except OSError as e:
+            logger.error(
+                "file.stat.failed",
+                bucket=bucket,
+                object_name=object_name,
+                error=str(e)
+            )
+            return None
+
+    async def iter_file_chunks(
+        self, 
+        bucket: str, 
+        object_name: str,
+        chunk_size: int = 1 << 20
+    ) -> AsyncIterator[bytes]:
+        """Потоковое чтение файла частями"""
+        loop = asyncio.get_event_loop()
+        
+        file_path = Path(bucket) / object_name
+        f = await loop.run_in_executor(None, open, file_path, 'rb')
+        
+        try:
+            while True:
+                chunk = await loop.run_in_executor(None, f.read, chunk_size)
+                if not chunk:
+                    break
+                yield chunk
+        finally:
+            f.close()
+
     async def list_files(
         self, 
         bucket: str, 
@@ -625,6 +739,23 @@ class StorageManager:
         """Получение содержимого файла"""
         return await self.backend.get_file_data(bucket, object_name)
 
+    async def get_file_size(
+        self, 
+        bucket: str, 
+        object_name: str
+    ) -> Optional[int]:
+        """Получение размера файла"""
+        return await self.backend.get_file_size(bucket, object_name)
+
+    def iter_file_chunks(
+        self, 
+        bucket: str, 
+        object_name: str,
+        chunk_size: int = 1 << 20
+    ) -> AsyncIterator[bytes]:
+        """Потоковое чтение файла частями"""
+        return self.backend.iter_file_chunks(bucket, object_name, chunk_size)
+
     async def list_files(
         self, 
         bucket: str, 
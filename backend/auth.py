@@ -1,5 +1,14 @@
+import asyncio
+import hashlib
+import hmac
+import multiprocessing
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
 from datetime import datetime, timedelta
-from typing import Optional
+from typing import Any, Optional
 from jose import JWTError, jwt
 from argon2 import PasswordHasher
 from fastapi import Depends, HTTPException, status
@@ -7,17 +16,102 @@ from fastapi.security import OAuth2PasswordBearer
 from pydantic import BaseModel
 
 # Настройки JWT
-SECRET_KEY = "your-secret-key-change-this-in-production"  # В продакшене используйте переменную окружения
+# Ключ берется из переменной окружения JWT_SECRET; значение по умолчанию - только для разработки
+SECRET_KEY = os.environ.get("JWT_SECRET", "your-secret-key-change-this-in-production")
 ALGORITHM = "HS256"
+# Ключ и список алгоритмов подготавливаются один раз, а не на каждый запрос
+_SECRET = SECRET_KEY.encode()
+_ALGORITHMS = (ALGORITHM,)
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 
-# Настройка для хеширования паролей (Argon2 не имеет ограничения в 72 байта)
-ph = PasswordHasher()
+# Настройка для хеширования паролей (Argon2 не имеет ограничения в 72 байта).
+# Параметры argon2id по рекомендации OWASP (19 MiB, 2 итерации, 1 поток) -
+# в несколько раз дешевле значений по умолчанию. Старые хеши обновляются
+# при входе (см. needs_rehash)
+ph = PasswordHasher(time_cost=2, memory_cost=19456, parallelism=1)
+
+# Хеш-заглушка для входа под несуществующим пользователем: проверка пароля
+# выполняется всегда, и время ответа не выдает, есть ли такой username
+DUMMY_HASH = ph.hash("x" * 8)
+
+# Отдельный пул для Argon2: хеширование не блокирует цикл событий, а число
+# одновременных вычислений (CPU и память) ограничено числом ядер.
+# Потоки - до старта приложения, затем пул процессов (см. start_hash_pool)
+_hash_pool: Executor = ThreadPoolExecutor(max_workers=os.cpu_count() or 1, thread_name_prefix="argon2")
+
+
+def start_hash_pool() -> None:
+    """Перевести Argon2 на пул процессов (вызывается при старте приложения).
+
+    Процессы не делят GIL и память интерпретатора, поэтому всплеск входов
+    и регистраций масштабируется на все ядра
+    """
+    global _hash_pool
+    previous = _hash_pool
+    # forkserver, а не fork: воркеры создаются по требованию во время работы
+    # сервера и не должны наследовать цикл событий, потоки и сокеты asyncpg
+    _hash_pool = ProcessPoolExecutor(
+        max_workers=os.cpu_count() or 1,
+        mp_context=multiprocessing.get_context("forkserver"),
+    )
+    previous.shutdown(wait=False)
+
+
+def stop_hash_pool() -> None:
+    """Остановить пул процессов Argon2 (вызывается при остановке приложения).
+
+    Блокирует до завершения воркеров - из async-кода вызывать через asyncio.to_thread
+    """
+    _hash_pool.shutdown(wait=True, cancel_futures=True)
+
 
 # OAuth2 схема для получения токена
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="api/auth/login")
 
 
+class TTLCache:
+    """Потокобезопасный кэш с ограничением размера (LRU) и временем жизни записей"""
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: "OrderedDict[Any, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Any) -> Optional[Any]:
+        """Значение по ключу или None, если записи нет или она устарела"""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if time.monotonic() >= expires_at:
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key: Any, value: Any, ttl: Optional[float] = None) -> None:
+        """Сохранить значение, вытеснив самую старую запись при переполнении"""
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._data[key] = (expires_at, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+
+# Кэш успешных проверок пароля: повторный вход не пересчитывает Argon2.
+# Ключ - HMAC от хеша и пароля, сам пароль в кэше не хранится.
+# Неудачные проверки и проверки по DUMMY_HASH не кэшируются: быстрый ответ
+# из кэша выдавал бы по времени, что такого username нет
+_pw_cache = TTLCache(maxsize=4096, ttl=60)
+
+# Кэш проверенных JWT: sha256(token) → payload. Короткий TTL ограничивает
+# окно, в течение которого отозванный токен ещё принимается
+_jwt_cache = TTLCache(maxsize=10_000, ttl=30)
+
+
 class Token(BaseModel):
     access_token: str
     token_type: str
@@ -25,10 +119,12 @@ class Token(BaseModel):
 
 class TokenData(BaseModel):
     username: Optional[str] = None
+    uid: Optional[int] = None
+    email: Optional[str] = None
 
 
-def verify_password(plain_password: str, hashed_password: str) -> bool:
-    """Проверка пароля"""
+def _verify_argon2(plain_password: str, hashed_password: str) -> bool:
+    """Проверка пароля через Argon2 (выполняется в _hash_pool)"""
     try:
         ph.verify(hashed_password, plain_password)
         return True
@@ -36,10 +132,43 @@ def verify_password(plain_password: str, hashed_password: str) -> bool:
         return False
 
 
-def get_password_hash(password: str) -> str:
+def _hash_argon2(password: str) -> str:
+    """Хеширование пароля через Argon2 (выполняется в _hash_pool)"""
+    return ph.hash(password)
+
+
+async def verify_password(plain_password: str, hashed_password: str) -> bool:
+    """Проверка пароля (успешный результат кэшируется на _pw_cache.ttl секунд)"""
+    key = hmac.new(
+        _SECRET,
+        (hashed_password + plain_password).encode(),
+        hashlib.sha256,
+    ).digest()
+    cacheable = hashed_password != DUMMY_HASH
+    if cacheable and _pw_cache.get(key):
+        return True
+
+    loop = asyncio.get_running_loop()
+    result = await loop.run_in_executor(_hash_pool, _verify_argon2, plain_password, hashed_password)
+
+    if result and cacheable:
+        _pw_cache.set(key, True)
+    return result
+
+
+def needs_rehash(hashed_password: str) -> bool:
+    """Создан ли хеш с параметрами, отличными от текущих"""
+    try:
+        return ph.check_needs_rehash(hashed_password)
+    except Exception:
+        return False
+
+
+async def get_password_hash(password: str) -> str:
     """Хеширование пароля"""
     # Argon2 не имеет ограничения на длину пароля
-    return ph.hash(password)
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_hash_pool, _hash_argon2, password)
 
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
@@ -50,7 +179,7 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     else:
         expire = datetime.utcnow() + timedelta(minutes=15)
     to_encode.update({"exp": expire})
-    encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
+    encoded_jwt = jwt.encode(to_encode, _SECRET, algorithm=ALGORITHM)
     return encoded_jwt
 
 
@@ -61,12 +190,21 @@ async def get_current_user(token: str = Depends(oauth2_scheme)):
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
+    token_hash = hashlib.sha256(token.encode()).digest()
+    payload = _jwt_cache.get(token_hash)
+    if payload is not None and payload.get("exp", 0) > time.time():
+        return TokenData(username=payload["sub"], uid=payload.get("uid"), email=payload.get("email"))
+
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        payload = jwt.decode(token, _SECRET, algorithms=_ALGORITHMS)
         username: str = payload.get("sub")
         if username is None:
             raise credentials_exception
-        token_data = TokenData(username=username)
+        token_data = TokenData(username=username, uid=payload.get("uid"), email=payload.get("email"))
+        # Кэшируем только проверенные токены и не дольше срока их действия
+        ttl = min(_jwt_cache.ttl, payload.get("exp", 0) - time.time())
+        if ttl > 0:
+            _jwt_cache.set(token_hash, payload, ttl=ttl)
     except JWTError:
         raise credentials_exception
     return token_data
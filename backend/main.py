@@ -1,10 +1,16 @@
-from fastapi import FastAPI, HTTPException, Body, Query, Depends, status
+from fastapi import FastAPI, HTTPException, Body, Query, Depends, Request, Response, status
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse
 from fastapi.security import OAuth2PasswordRequestForm
 from typing import Dict, Any
 from pydantic import BaseModel, ConfigDict
-from sqlalchemy.orm import Session
+from sqlalchemy import select, text
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
 from contextlib import asynccontextmanager
+import asyncio
+import logging
+import orjson
 import uvicorn
 
 from datetime import timedelta
@@ -13,24 +19,88 @@ from models import User, Conversation
 from auth import (
     verify_password,
     get_password_hash,
+    needs_rehash,
     create_access_token,
     get_current_user,
+    DUMMY_HASH,
+    TTLCache,
+    start_hash_pool,
+    stop_hash_pool,
     Token,
     ACCESS_TOKEN_EXPIRE_MINUTES,
     TokenData
 )
-from stats import calculate_stats
+from stats import calculate_stats_bytes
+
+logger = logging.getLogger(__name__)
+
+# Формат date_time, который отдает PostgreSQL (ISO 8601 в UTC, как isoformat()) -
+# строка приходит готовой, без создания datetime на стороне Python
+DATE_TIME_FORMAT = 'YYYY-MM-DD"T"HH24:MI:SS.US"+00:00"'
+
+# Горячие запросы собираются один раз: одинаковый текст SQL попадает в кэш
+# компиляции SQLAlchemy и в кэш prepared statements asyncpg на соединении
+LIST_CONVERSATIONS_SQL = text(
+    "SELECT json_agg(json_build_object("
+    "'id', id, "
+    "'file_data', file_data, "
+    "'file_name', file_name, "
+    "'file_path', file_path, "
+    "'date_time', to_char(date_time AT TIME ZONE 'UTC', :fmt)"
+    ") ORDER BY id)::text FROM conversations"
+)
+GET_CONVERSATION_SQL = text(
+    "SELECT id, file_data::text AS file_data, file_name, file_path, "
+    "to_char(date_time AT TIME ZONE 'UTC', :fmt) AS date_time "
+    "FROM conversations WHERE id = :id"
+)
+CONVERSATION_DATA_SQL = text("SELECT file_data FROM conversations WHERE id = :id")
+CONVERSATION_VERSION_SQL = text("SELECT extract(epoch FROM date_time) FROM conversations WHERE id = :id")
+
+# Готовый JSON статистики не меняется, пока не изменилась запись: ключ - (id, версия)
+_stats_cache = TTLCache(maxsize=1000, ttl=300)
+
+
+async def _conversation_etag(db: AsyncSession, conversation_id: int) -> str:
+    """Слабый ETag разговора по id и date_time (404, если разговора нет)"""
+    version = (await db.execute(CONVERSATION_VERSION_SQL, {"id": conversation_id})).scalar()
+    if version is None:
+        raise HTTPException(status_code=404, detail="Conversation not found")
+    return f'W/"{conversation_id}-{version}"'
+
+
+def _not_modified(request: Request, etag: str) -> bool:
+    """
+    Совпадает ли ETag с If-None-Match клиента.
+    
+    Заголовок может содержать список ETag через запятую или "*".
+    Сравнение слабое (RFC 9110): префикс W/ не учитывается.
+    """
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    opaque = etag.removeprefix("W/")
+    for candidate in header.split(","):
+        candidate = candidate.strip()
+        if candidate == "*" or candidate.removeprefix("W/") == opaque:
+            return True
+    return False
+
 
 # --- Lifespan для создания таблиц ---
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # Startup: создание всех таблиц (если их нет)
-    Base.metadata.create_all(bind=engine)
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    start_hash_pool()
     yield
-    # Shutdown: можно добавить код для закрытия соединений
+    # Shutdown: закрытие соединений пула и процессов Argon2
+    await engine.dispose()
+    await asyncio.to_thread(stop_hash_pool)
 
 
-app = FastAPI(title="Conversations API", lifespan=lifespan)
+app = FastAPI(title="Conversations API", lifespan=lifespan, default_response_class=ORJSONResponse)
 
 app.add_middleware(
     CORSMiddleware,
@@ -68,41 +138,29 @@ class ConversationResponse(BaseModel):
 # --- Эндпоинты авторизации ---
 
 @app.post("/api/auth/register", response_model=dict, status_code=status.HTTP_201_CREATED)
-def register(user_data: UserRegister, db: Session = Depends(get_db)):
+async def register(user_data: UserRegister, db: AsyncSession = Depends(get_db)):
     """Регистрация нового пользователя"""
-    # Проверка существования пользователя
-    existing_user = db.query(User).filter(
-        (User.username == user_data.username) | (User.email == user_data.email)
-    ).first()
-    
-    if existing_user:
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail="Username or email already registered"
+    # Хеширование пароля (в пуле Argon2)
+    hashed_password = await get_password_hash(user_data.password)
+
+    # Проверка уникальности и вставка - одним атомарным запросом:
+    # при конфликте по username или email строка не возвращается
+    insert_stmt = (
+        pg_insert(User)
+        .values(
+            username=user_data.username,
+            email=user_data.email,
+            hashed_password=hashed_password
         )
-    
-    # Хеширование пароля и создание пользователя
-    hashed_password = get_password_hash(user_data.password)
-    new_user = User(
-        username=user_data.username,
-        email=user_data.email,
-        hashed_password=hashed_password
+        .on_conflict_do_nothing()
+        .returning(User.id, User.username, User.email)
     )
-    
+
     try:
-        db.add(new_user)
-        db.commit()
-        db.refresh(new_user)
-        return {
-            "message": "User registered successfully",
-            "user": {
-                "id": new_user.id,
-                "username": new_user.username,
-                "email": new_user.email
-            }
-        }
+        new_user = (await db.execute(insert_stmt)).first()
+        await db.commit()
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         import traceback
         error_detail = str(e)
         # Логируем полную ошибку для отладки
@@ -113,40 +171,73 @@ def register(user_data: UserRegister, db: Session = Depends(get_db)):
             detail=f"Error creating user: {error_detail}"
         )
 
+    if new_user is None:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Username or email already registered"
+        )
+
+    return {
+        "message": "User registered successfully",
+        "user": {
+            "id": new_user.id,
+            "username": new_user.username,
+            "email": new_user.email
+        }
+    }
+
 
 @app.post("/api/auth/login", response_model=Token)
-def login(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
+async def login(form_data: OAuth2PasswordRequestForm = Depends(), db: AsyncSession = Depends(get_db)):
     """Вход пользователя и получение JWT токена"""
     # Поиск пользователя по username
-    user = db.query(User).filter(User.username == form_data.username).first()
+    result = await db.execute(select(User).where(User.username == form_data.username))
+    user = result.scalars().first()
     
     if not user:
+        # Та же работа Argon2, что и для существующего пользователя (без кэша)
+        await verify_password(form_data.password, DUMMY_HASH)
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect username or password",
             headers={"WWW-Authenticate": "Bearer"},
         )
     
-    # Проверка пароля
-    if not verify_password(form_data.password, user.hashed_password):
+    # Проверка пароля (в пуле Argon2)
+    if not await verify_password(form_data.password, user.hashed_password):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect username or password",
             headers={"WWW-Authenticate": "Bearer"},
         )
     
+    # Хеш со старыми параметрами Argon2 - пересчитать, пока пароль известен
+    if needs_rehash(user.hashed_password):
+        try:
+            user.hashed_password = await get_password_hash(form_data.password)
+            await db.commit()
+        except Exception:
+            await db.rollback()
+            logger.exception("Password rehash error")
+
     # Создание токена
     access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     access_token = create_access_token(
-        data={"sub": user.username}, expires_delta=access_token_expires
+        data={"sub": user.username, "uid": user.id, "email": user.email},
+        expires_delta=access_token_expires
     )
     return {"access_token": access_token, "token_type": "bearer"}
 
 
 @app.get("/api/auth/me", response_model=UserResponse)
-def read_users_me(current_user: TokenData = Depends(get_current_user), db: Session = Depends(get_db)):
+async def read_users_me(current_user: TokenData = Depends(get_current_user), db: AsyncSession = Depends(get_db)):
     """Получение информации о текущем пользователе"""
-    user = db.query(User).filter(User.username == current_user.username).first()
+    # id и email приходят в claims токена - запрос к БД только для старых токенов
+    if current_user.uid is not None and current_user.email is not None:
+        return UserResponse(id=current_user.uid, username=current_user.username, email=current_user.email)
+
+    result = await db.execute(select(User).where(User.username == current_user.username))
+    user = result.scalars().first()
     if not user:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -158,12 +249,12 @@ def read_users_me(current_user: TokenData = Depends(get_current_user), db: Sessi
 # --- Эндпоинты для разговоров ---
 
 @app.post("/api/conversations")
-def add_conversation(
+async def add_conversation(
     conversation: Dict[str, Any] = Body(...),
     fname: str = Query(...),
     fpath: str = Query(...),
     current_user: TokenData = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """Добавление нового разговора"""
     try:
@@ -172,62 +263,75 @@ def add_conversation(
             file_name=fname,
             file_path=fpath
         )
-        db.add(new_conversation)
-        db.commit()
-        db.refresh(new_conversation)
+        # Запись в явной транзакции: commit при выходе, rollback при ошибке
+        async with db.begin():
+            db.add(new_conversation)
+            await db.flush()
         return {"id": new_conversation.id}
     except Exception as e:
-        db.rollback()
         raise HTTPException(status_code=500, detail=str(e))
 
 
 @app.get("/api/conversations")
-def get_all_conversations(
+async def get_all_conversations(
     current_user: TokenData = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """Получение списка всех разговоров"""
-    conversations = db.query(Conversation).all()
-    result = []
-    for conv in conversations:
-        result.append({
-            "id": conv.id,
-            "file_data": conv.file_data,
-            "file_name": conv.file_name,
-            "file_path": conv.file_path,
-            "date_time": conv.date_time.isoformat() if conv.date_time else None
-        })
-    return result
+    # JSON ответа собирает PostgreSQL - без ORM-объектов и словарей на каждую строку.
+    # ::text - чтобы драйвер не разбирал JSON обратно в Python-объекты
+    content = (await db.execute(LIST_CONVERSATIONS_SQL, {"fmt": DATE_TIME_FORMAT})).scalar()
+    return Response(content=content or "[]", media_type="application/json")
 
 
 @app.get("/api/conversations/{conversation_id}")
-def get_conversation(
+async def get_conversation(
     conversation_id: int,
+    request: Request,
     current_user: TokenData = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """Получение конкретного разговора по ID"""
-    conversation = db.query(Conversation).filter(Conversation.id == conversation_id).first()
+    # Дешевая проверка версии: при совпадении ETag тело не читается вовсе
+    etag = await _conversation_etag(db, conversation_id)
+    if _not_modified(request, etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
+
+    # Чтение без ORM. file_data забираем текстом: orjson.Fragment вставляет
+    # готовый JSON в ответ как есть, без разбора и повторной сериализации
+    result = await db.execute(GET_CONVERSATION_SQL, {"id": conversation_id, "fmt": DATE_TIME_FORMAT})
+    conversation = result.first()
     if not conversation:
         raise HTTPException(status_code=404, detail="Conversation not found")
     
-    return {
+    return ORJSONResponse({
         "id": conversation.id,
-        "file_data": conversation.file_data,
+        "file_data": orjson.Fragment(conversation.file_data) if conversation.file_data is not None else None,
         "file_name": conversation.file_name,
         "file_path": conversation.file_path,
-        "date_time": conversation.date_time.isoformat() if conversation.date_time else None
-    }
+        "date_time": conversation.date_time
+    }, headers={"ETag": etag})
 
 
 @app.get("/api/analyze/stats/{conversation_id}")
-def analyze_stats(
+async def analyze_stats(
     conversation_id: int,
+    request: Request,
     current_user: TokenData = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """Получение статистики разговора"""
-    conversation = db.query(Conversation).filter(Conversation.id == conversation_id).first()
+    etag = await _conversation_etag(db, conversation_id)
+    if _not_modified(request, etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
+
+    content = _stats_cache.get(etag)
+    if content is not None:
+        return Response(content=content, media_type="application/json", headers={"ETag": etag})
+
+    # Нужен только file_data - без загрузки ORM-объекта
+    result = await db.execute(CONVERSATION_DATA_SQL, {"id": conversation_id})
+    conversation = result.first()
     if not conversation:
         raise HTTPException(status_code=404, detail="Conversation not found")
     
@@ -235,8 +339,9 @@ def analyze_stats(
         raise HTTPException(status_code=404, detail="No data")
     
     # Вычисляем статистику из file_data
-    stats = calculate_stats(conversation.file_data)
-    return stats
+    content = calculate_stats_bytes(conversation.file_data)
+    _stats_cache.set(etag, content)
+    return Response(content=content, media_type="application/json", headers={"ETag": etag})
 
 
 # --- Авто-запуск через python main.py ---
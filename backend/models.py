@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, DateTime, Text
+from sqlalchemy import Column, Integer, String, DateTime, Text, Index
 from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy.sql import func
 from database import Base
@@ -25,3 +25,6 @@ class Conversation(Base):
     file_path = Column(String(255), nullable=False)
     date_time = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
 
+
+# Индекс для выборок по дате (новые разговоры первыми)
+Index("ix_conversations_date_time_desc", Conversation.date_time.desc())
@@ -1,11 +1,21 @@
 """
 Модуль для вычисления статистики разговоров из file_data
 """
-from typing import Dict, Any, List
+from array import array
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
 from collections import defaultdict, Counter
+from datetime import time
+from operator import itemgetter
 
+import orjson
 
-def calculate_stats(file_data: Dict[str, Any]) -> Dict[str, Any]:
+_parse_time = time.fromisoformat
+
+# Общий пустой словарь вместо нового {} на каждый отсутствующий ключ (только для чтения)
+_EMPTY: Dict[str, Any] = {}
+
+
+def calculate_stats(file_data: Optional[Dict[str, Any]]) -> Dict[str, Any]:
     """
     Вычисляет статистику разговора из file_data
     
@@ -18,112 +28,195 @@ def calculate_stats(file_data: Dict[str, Any]) -> Dict[str, Any]:
     if not file_data or "splitted" not in file_data:
         return _empty_stats()
     
+    return _compute_stats(file_data)
+
+
+def calculate_stats_bytes(file_data: Optional[Dict[str, Any]]) -> bytes:
+    """
+    Вычисляет статистику разговора сразу в виде JSON (bytes)
+    
+    Для ответа API: сериализация одним вызовом orjson, без повторного
+    обхода результата через jsonable_encoder/json
+    """
+    return orjson.dumps(calculate_stats(file_data))
+
+
+def _compute_stats(file_data: Dict[str, Any]) -> Dict[str, Any]:
+    """Вычисление статистики по списку фрагментов file_data (см. calculate_stats)"""
     fragments = file_data.get("splitted", [])
     if not fragments:
         return _empty_stats()
     
-    # Инициализация счетчиков
-    speaker_stats = defaultdict(lambda: {
+    # Имена классов и эмоций собираются в списки и считаются Counter'ом (в C) в конце
+    class_names: List[str] = []
+    emotion_names: List[str] = []
+    add_class = class_names.append
+    add_emotion = emotion_names.append
+    
+    # Время и спикеры разбираются один раз в отдельные списки (SoA),
+    # дальше все вычисления идут по целым числам
+    starts = [_time_to_ms(fragment.get("start", "0:0:0")) for fragment in fragments]
+    stops = [_time_to_ms(fragment.get("stop", "0:0:0")) for fragment in fragments]
+    speakers = [fragment.get("speaker", 0) for fragment in fragments]
+    
+    # Статистика по спикерам
+    speaker_stats, total_duration_ms = _aggregate_speakers(fragments, starts, stops, speakers)
+    
+    # Обработка фрагментов
+    for fragment in fragments:
+        _collect_labels(fragment, add_class, add_emotion)
+    
+    return _build_stats(
+        speaker_stats, total_duration_ms, class_names, emotion_names,
+        len(fragments), starts, stops, speakers
+    )
+
+
+def calculate_stats_stream(fragments: Iterable[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Вычисляет статистику по итератору фрагментов за один проход
+    
+    Список фрагментов целиком не нужен: каждый фрагмент читается один раз,
+    в памяти остаются только время (array), спикеры и счетчики. Подходит для
+    потокового разбора больших file_data, например ijson.items(f, "splitted.item")
+    
+    Args:
+        fragments: Итератор фрагментов (элементы file_data["splitted"])
+        
+    Returns:
+        Словарь со статистикой (как у calculate_stats)
+    """
+    starts = array("q")
+    stops = array("q")
+    speakers: List[Any] = []
+    speaker_stats: Dict[Any, Dict[str, Any]] = defaultdict(lambda: {
         "durationMs": 0,
         "fragments": 0,
         "age": None,
         "gender": None
     })
-    class_counter = Counter()
-    emotion_counter = Counter()
     total_duration_ms = 0
-    overlaps = []
+    class_names: List[str] = []
+    emotion_names: List[str] = []
+    add_class = class_names.append
+    add_emotion = emotion_names.append
     
-    # Обработка фрагментов
     for fragment in fragments:
-        speaker_id = fragment.get("speaker", 0)
         start_ms = _time_to_ms(fragment.get("start", "0:0:0"))
         stop_ms = _time_to_ms(fragment.get("stop", "0:0:0"))
-        duration_ms = stop_ms - start_ms
-        
-        # Статистика по спикерам
-        speaker_stats[speaker_id]["durationMs"] += duration_ms
-        speaker_stats[speaker_id]["fragments"] += 1
-        
-        # Получение возраста и пола из первого фрагмента спикера
-        if speaker_stats[speaker_id]["age"] is None:
-            voice_analysis = fragment.get("voice_analysis", {})
-            speaker_stats[speaker_id]["age"] = voice_analysis.get("age", "unknown")
-            speaker_stats[speaker_id]["gender"] = voice_analysis.get("gender", "unknown")
+        speaker_id = fragment.get("speaker", 0)
+        starts.append(start_ms)
+        stops.append(stop_ms)
+        speakers.append(speaker_id)
         
+        duration_ms = stop_ms - start_ms
+        stats = speaker_stats[speaker_id]
+        stats["durationMs"] += duration_ms
+        stats["fragments"] += 1
+        if stats["age"] is None:
+            voice_analysis = fragment.get("voice_analysis") or _EMPTY
+            stats["age"] = voice_analysis.get("age", "unknown")
+            stats["gender"] = voice_analysis.get("gender", "unknown")
         total_duration_ms += duration_ms
         
-        # Классы
-        classifiers = fragment.get("classifiers", {})
-        smc = classifiers.get("smc", {})
-        скрипты = smc.get("Скрипты1", {})
-        classes = скрипты.get("classes", [])
-        if classes:
-            class_name = classes[0].get("class", "N/A")
-            class_counter[class_name] += 1
-        
-        # Эмоции
-        emotion = fragment.get("emotion")
-        if emotion and isinstance(emotion, dict):
-            emotion_name = list(emotion.keys())[0] if emotion else "N/A"
-            emotion_counter[emotion_name] += 1
-        elif isinstance(emotion, str):
-            emotion_counter[emotion] += 1
-        else:
-            voice_emotion = fragment.get("voice_analysis", {}).get("emotion", {})
-            if voice_emotion:
-                emotion_name = voice_emotion.get("class", "N/A")
-                emotion_counter[emotion_name] += 1
+        _collect_labels(fragment, add_class, add_emotion)
+    
+    if not speakers:
+        return _empty_stats()
+    
+    return _build_stats(
+        speaker_stats, total_duration_ms, class_names, emotion_names,
+        len(speakers), starts, stops, speakers
+    )
+
+
+def _collect_labels(
+    fragment: Dict[str, Any], add_class: Callable[[Any], None], add_emotion: Callable[[Any], None]
+) -> None:
+    """Добавляет класс и эмоцию фрагмента (если они есть) через add_class/add_emotion"""
+    # Классы: ключи обычно есть, поэтому try дешевле цепочки .get(..., {});
+    # пустой список классов - IndexError, отсутствующий уровень - KeyError/TypeError
+    try:
+        add_class(fragment["classifiers"]["smc"]["Скрипты1"]["classes"][0].get("class", "N/A"))
+    except (KeyError, IndexError, TypeError):
+        pass
+    
+    # Эмоции: voice_analysis читается, только если у фрагмента нет своей эмоции
+    emotion = fragment.get("emotion")
+    if isinstance(emotion, str):
+        add_emotion(emotion)
+    elif isinstance(emotion, dict) and emotion:
+        add_emotion(next(iter(emotion)))
+    else:
+        voice_analysis = fragment.get("voice_analysis")
+        voice_emotion = voice_analysis.get("emotion") if voice_analysis else None
+        if voice_emotion:
+            add_emotion(voice_emotion.get("class", "N/A"))
+
+
+def _build_stats(
+    speaker_stats: Dict[Any, Dict[str, Any]],
+    total_duration_ms: int,
+    class_names: List[str],
+    emotion_names: List[str],
+    total_fragments: int,
+    starts: Sequence[int],
+    stops: Sequence[int],
+    speakers: List[Any],
+) -> Dict[str, Any]:
+    """Итоговая статистика из собранных по фрагментам данных"""
+    # Одна сортировка по убыванию частоты - и для списков, и для топ-значений
+    # (сортировка устойчивая, порядок равных как у most_common)
+    sorted_classes = sorted(Counter(class_names).items(), key=itemgetter(1), reverse=True)
+    sorted_emotions = sorted(Counter(emotion_names).items(), key=itemgetter(1), reverse=True)
     
     # Вычисление наложений (упрощенная версия)
-    overlaps = _calculate_overlaps(fragments)
+    overlaps, overlap_total_ms = _calculate_overlaps(starts, stops, speakers)
     
     # Форматирование статистики спикеров
     speaker_count = len(speaker_stats)
-    speaker_stats_list = []
+    speaker_stats_list: List[Dict[str, Any]] = []
+    # Множитель процента считается один раз - в циклах только умножение
+    duration_pct = 100 / total_duration_ms if total_duration_ms > 0 else 0
     for speaker_id, stats in sorted(speaker_stats.items()):
-        percentage = (stats["durationMs"] / total_duration_ms * 100) if total_duration_ms > 0 else 0
         speaker_stats_list.append({
             "id": speaker_id,
             "durationMs": stats["durationMs"],
-            "percentage": round(percentage, 1),
+            "percentage": round(stats["durationMs"] * duration_pct, 1),
             "age": stats["age"] or "unknown",
             "gender": stats["gender"] or "unknown",
             "fragments": stats["fragments"]
         })
     
     # Форматирование статистики классов
-    total_fragments = len(fragments)
-    class_stats_list = []
-    for class_name, count in class_counter.most_common():
-        percentage = (count / total_fragments * 100) if total_fragments > 0 else 0
+    fragment_pct = 100 / total_fragments if total_fragments > 0 else 0
+    class_stats_list: List[Dict[str, Any]] = []
+    for class_name, count in sorted_classes:
         class_stats_list.append({
             "class": class_name,
             "count": count,
-            "percentage": round(percentage, 1)
+            "percentage": round(count * fragment_pct, 1)
         })
     
     # Форматирование статистики эмоций
-    emotion_stats_list = []
-    for emotion_name, count in emotion_counter.most_common():
-        percentage = (count / total_fragments * 100) if total_fragments > 0 else 0
+    emotion_stats_list: List[Dict[str, Any]] = []
+    for emotion_name, count in sorted_emotions:
         emotion_stats_list.append({
             "emotion": emotion_name,
             "count": count,
-            "percentage": round(percentage, 1)
+            "percentage": round(count * fragment_pct, 1)
         })
     
     # Вычисление наложений
     overlap_count = len(overlaps)
-    overlap_total_ms = sum(overlap["duration_ms"] for overlap in overlaps)
-    overlap_percentage = (overlap_total_ms / total_duration_ms * 100) if total_duration_ms > 0 else 0
+    overlap_percentage = overlap_total_ms * duration_pct
     
     # Средняя длительность фрагмента
     avg_fragment_duration = (total_duration_ms / total_fragments / 1000) if total_fragments > 0 else 0
     
     # Топ эмоция и класс
-    top_emotion = emotion_counter.most_common(1)[0][0] if emotion_counter else "N/A"
-    top_class = class_counter.most_common(1)[0][0] if class_counter else "N/A"
+    top_emotion = sorted_emotions[0][0] if sorted_emotions else "N/A"
+    top_class = sorted_classes[0][0] if sorted_classes else "N/A"
     
     return {
         "totalDuration": _ms_to_time_string(total_duration_ms),
@@ -144,8 +237,52 @@ def calculate_stats(file_data: Dict[str, Any]) -> Dict[str, Any]:
     }
 
 
+def _aggregate_speakers(
+    fragments: List[Dict[str, Any]], starts: List[int], stops: List[int], speakers: List[Any]
+) -> Tuple[Dict[Any, Dict[str, Any]], int]:
+    """
+    Длительность, число фрагментов, возраст и пол по каждому спикеру
+    
+    Returns:
+        (статистика по спикерам, общая длительность в мс)
+    """
+    speaker_stats: Dict[Any, Dict[str, Any]] = defaultdict(lambda: {
+        "durationMs": 0,
+        "fragments": 0,
+        "age": None,
+        "gender": None
+    })
+    total_duration_ms = 0
+    for fragment, speaker_id, start_ms, stop_ms in zip(fragments, speakers, starts, stops):
+        duration_ms = stop_ms - start_ms
+        
+        stats = speaker_stats[speaker_id]
+        stats["durationMs"] += duration_ms
+        stats["fragments"] += 1
+        
+        # Получение возраста и пола из первого фрагмента спикера
+        if stats["age"] is None:
+            voice_analysis = fragment.get("voice_analysis") or _EMPTY
+            stats["age"] = voice_analysis.get("age", "unknown")
+            stats["gender"] = voice_analysis.get("gender", "unknown")
+        
+        total_duration_ms += duration_ms
+    
+    return speaker_stats, total_duration_ms
+
+
 def _time_to_ms(time_str: str) -> int:
     """Конвертирует строку времени 'HH:MM:SS.mmm' в миллисекунды"""
+    # Быстрый путь для стандартного формата: разбор в C через time.fromisoformat
+    if len(time_str) == 12 and time_str[2] == ":" and time_str[5] == ":" and time_str[8] == ".":
+        try:
+            t = _parse_time(time_str)
+            if t.tzinfo is None:
+                return ((t.hour * 60 + t.minute) * 60 + t.second) * 1000 + t.microsecond // 1000
+        except ValueError:
+            pass
+    
+    # Общий случай - произвольная длина полей и необязательные миллисекунды
     try:
         parts = time_str.split(":")
         hours = int(parts[0]) if len(parts) > 0 else 0
@@ -168,45 +305,63 @@ def _ms_to_time_string(ms: int) -> str:
     return f"{hours:02d}:{minutes:02d}:{seconds:02d}"
 
 
-def _calculate_overlaps(fragments: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+def _calculate_overlaps(
+    starts: Sequence[int], stops: Sequence[int], speakers: List[Any]
+) -> Tuple[List[Dict[str, Any]], int]:
     """
     Вычисляет наложения речи между спикерами
-    Упрощенная версия - ищет пересечения временных интервалов
-    """
-    overlaps = []
+    Sweep-line по событиям начала/конца фрагментов: интервал считается
+    наложением, пока активны хотя бы два разных спикера. O(N log N)
     
-    # Сортируем фрагменты по времени начала
-    sorted_fragments = sorted(fragments, key=lambda f: _time_to_ms(f.get("start", "0:0:0")))
+    Returns:
+        (интервалы наложений, их суммарная длительность в мс)
+    """
+    # События (ключ, спикер); пустые фрагменты не участвуют. Ключ - время * 2
+    # плюс 1 для начала: при равном времени конец идет раньше начала, и касание
+    # не считается наложением. Сортировка по готовому int-ключу, без лямбды
+    events: List[Tuple[int, Any]] = []
+    for start_ms, stop_ms, speaker_id in zip(starts, stops, speakers):
+        if start_ms < stop_ms:
+            events.append((start_ms * 2 + 1, speaker_id))
+            events.append((stop_ms * 2, speaker_id))
+    events.sort(key=itemgetter(0))
     
-    for i, frag1 in enumerate(sorted_fragments):
-        start1 = _time_to_ms(frag1.get("start", "0:0:0"))
-        stop1 = _time_to_ms(frag1.get("stop", "0:0:0"))
-        speaker1 = frag1.get("speaker", 0)
-        
-        for j, frag2 in enumerate(sorted_fragments[i + 1:], start=i + 1):
-            start2 = _time_to_ms(frag2.get("start", "0:0:0"))
-            stop2 = _time_to_ms(frag2.get("stop", "0:0:0"))
-            speaker2 = frag2.get("speaker", 0)
-            
-            # Пропускаем, если это тот же спикер
-            if speaker1 == speaker2:
-                continue
-            
-            # Проверяем пересечение интервалов
-            overlap_start = max(start1, start2)
-            overlap_end = min(stop1, stop2)
-            
-            if overlap_start < overlap_end:
-                # Есть наложение
-                duration_ms = overlap_end - overlap_start
+    overlaps: List[Dict[str, Any]] = []
+    active: Dict[Any, int] = {}  # спикер -> число его активных фрагментов
+    prev_ms = 0
+    total_ms = 0
+    for key, speaker_id in events:
+        time_ms = key >> 1
+        if time_ms > prev_ms and len(active) >= 2:
+            total_ms += time_ms - prev_ms
+            # Кортеж без сортировки для обычного случая двух спикеров
+            active_speakers: Tuple[Any, ...]
+            if len(active) == 2:
+                first, second = active
+                active_speakers = (first, second) if first < second else (second, first)
+            else:
+                active_speakers = tuple(sorted(active))
+            last = overlaps[-1] if overlaps else None
+            if last and last["end_ms"] == prev_ms and last["speakers"] == active_speakers:
+                # Продолжение наложения тех же спикеров - расширяем интервал
+                last["end_ms"] = time_ms
+                last["duration_ms"] = time_ms - last["start_ms"]
+            else:
                 overlaps.append({
-                    "start_ms": overlap_start,
-                    "end_ms": overlap_end,
-                    "duration_ms": duration_ms,
-                    "speakers": sorted([speaker1, speaker2])
+                    "start_ms": prev_ms,
+                    "end_ms": time_ms,
+                    "duration_ms": time_ms - prev_ms,
+                    "speakers": active_speakers
                 })
+        
+        count = active.get(speaker_id, 0) + (1 if key & 1 else -1)
+        if count:
+            active[speaker_id] = count
+        else:
+            del active[speaker_id]
+        prev_ms = time_ms
     
-    return overlaps
+    return overlaps, total_ms
 
 
 def _empty_stats() -> Dict[str, Any]: